@@ -0,0 +1,109 @@
+''' Asyncio counterparts of L{Search}, L{Suggest}, L{Bulk} and L{ScanAndScroll}
+(requires Python 3.5+).
+
+These accept the same L{ElasticQuery}, L{Aggs} and L{Sort} objects and return
+the same L{Result}, L{Document} and L{Aggregation} types. Requests are made
+with the pooled L{Transport} from a thread pool so that independent searches
+can be awaited together from async views, I{e.g.}::
+
+    (genes, markers) = await asyncio.gather(
+        AsyncSearch(gene_query, idx=ElasticSettings.idx('GENE')).search(),
+        AsyncSuggest.suggest('rs24', ElasticSettings.idx('MARKER')))
+'''
+import asyncio
+import functools
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from elastic.elastic_settings import ElasticSettings
+from elastic.search import Search, Suggest, Bulk, ScanAndScroll
+from elastic.transport import Transport
+
+# Get an instance of a logger
+logger = logging.getLogger(__name__)
+
+_EXECUTOR = None
+_EXECUTOR_LOCK = threading.Lock()
+
+
+def get_executor():
+    ''' Return the thread pool used to make requests, sized to the transport pool. '''
+    global _EXECUTOR
+    if _EXECUTOR is None:
+        with _EXECUTOR_LOCK:
+            if _EXECUTOR is None:
+                pool_size = ElasticSettings.getattr('POOL_SIZE', default=Transport.POOL_SIZE)
+                _EXECUTOR = ThreadPoolExecutor(max_workers=pool_size)
+    return _EXECUTOR
+
+
+def run_request(fun, *args, **kwargs):
+    ''' Run a blocking request function in the executor and return an awaitable. '''
+    loop = asyncio.get_event_loop()
+    return loop.run_in_executor(get_executor(), functools.partial(fun, *args, **kwargs))
+
+
+class AsyncSearch(Search):
+    ''' Asyncio version of L{Search}; the request methods are coroutines. '''
+
+    async def get_json_response(self):
+        ''' Return the elastic json response '''
+        return await run_request(super().get_json_response)
+
+    async def search(self):
+        ''' Run the search and return a L{Result} that stores the
+        L{Document} and L{Aggregation} objects. '''
+        return self._build_result(await self.get_json_response())
+
+    async def get_count(self):
+        ''' Return the elastic count for a query result '''
+        return await run_request(super().get_count)
+
+    async def get_mapping(self, mapping_type=None):
+        ''' Return the mappings for an index. '''
+        return await run_request(super().get_mapping, mapping_type)
+
+
+class AsyncSuggest(object):
+    ''' Asyncio version of L{Suggest}. '''
+
+    @classmethod
+    async def suggest(cls, term, idx, elastic_url=None, name='data', field='suggest', size=5):
+        ''' Auto completion suggestions for a given term. '''
+        return await run_request(Suggest.suggest, term, idx, elastic_url=elastic_url,
+                                 name=name, field=field, size=size)
+
+
+class AsyncBulk(object):
+    ''' Asyncio version of L{Bulk}. '''
+
+    @classmethod
+    async def load(cls, idx, idx_type, json_data, elastic_url=None):
+        ''' Bulk load documents. '''
+        return await run_request(Bulk.load, idx, idx_type, json_data, elastic_url=elastic_url)
+
+
+class AsyncScanAndScroll(object):
+    ''' Asyncio version of L{ScanAndScroll}. '''
+
+    @classmethod
+    async def scan_and_scroll(cls, idx, call_fun=None, idx_type='', url=None,
+                              time_to_keep_scoll=1, query=None, slices=1):
+        ''' Scan and scroll an index and optionally provide a function or
+        coroutine function argument to process the hits. '''
+        pages = ScanAndScroll.iter_pages(idx, idx_type=idx_type, url=url, time_to_keep_scoll=time_to_keep_scoll,
+                                         query=query, slices=slices)
+        count = 0
+        try:
+            while True:
+                resp_json = await run_request(next, pages, None)
+                if resp_json is None:
+                    break
+                count += len(resp_json['hits']['hits'])
+                if call_fun is not None:
+                    res = call_fun(resp_json)
+                    if asyncio.iscoroutine(res):
+                        await res
+        finally:
+            await run_request(pages.close)
+        logger.debug("Scanned No. Docs ( "+idx+"/"+idx_type+" ) = "+str(count))
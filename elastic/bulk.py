@@ -0,0 +1,188 @@
+''' Bulk request building and parallel bulk indexing.
+
+A L{BulkBuffer} collects bulk API actions and hands the request body to a
+flush function once it reaches a target size or number of documents, so that
+requests are of a similar size however wide the documents are, I{e.g.}::
+
+    with BulkBuffer(lambda data: Bulk.load(idx, idx_type, data), max_bytes=5000000) as buf:
+        for doc in docs:
+            buf.add({"index": {"_id": doc['id']}}, doc)
+
+A L{BulkIndexer} hands chunks of bulk API data to a pool of sender threads
+through a bounded queue so that parsing the next chunk overlaps with indexing
+the previous ones. When the queue is full L{BulkIndexer.add} blocks until a
+sender is free, so a fast reader cannot run ahead of the cluster, I{e.g.}::
+
+    with BulkIndexer(idx, idx_type, threads=4, queue_size=8) as indexer:
+        for json_data in chunks:
+            indexer.add(json_data)
+    logger.info(indexer.stats())
+'''
+import json
+import queue
+import threading
+import logging
+from elastic.search import Bulk
+
+# Get an instance of a logger
+logger = logging.getLogger(__name__)
+
+
+class BulkBuffer(object):
+    ''' Build bulk API request bodies, flushing on size or document count. '''
+
+    MAX_BYTES = 5000000
+    MAX_DOCS = 5000
+
+    def __init__(self, flush_fn, max_bytes=MAX_BYTES, max_docs=MAX_DOCS):
+        ''' Set up the buffer.
+        @type  flush_fn: function
+        @param flush_fn: Called with the request body when the buffer is flushed.
+        @type  max_bytes: integer
+        @keyword max_bytes: Request body size (in characters) that triggers a flush.
+        @type  max_docs: integer
+        @keyword max_docs: Number of actions that triggers a flush.
+        '''
+        self.flush_fn = flush_fn
+        self.max_bytes = max_bytes
+        self.max_docs = max_docs
+        self.docs = 0
+        self.flushes = 0
+        self._parts = []
+        self._size = 0
+        self._ndocs = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.flush()
+
+    def add(self, action, source=None):
+        ''' Add an action and (except for deletes) its source document. Each may be
+        a dictionary or an already serialised JSON string. '''
+        self._append(action)
+        if source is not None:
+            self._append(source)
+        self.docs += 1
+        self._ndocs += 1
+        if self._size >= self.max_bytes or self._ndocs >= self.max_docs:
+            self.flush()
+
+    def _append(self, line):
+        if not isinstance(line, str):
+            line = json.dumps(line)
+        self._parts.append(line)
+        self._parts.append('\n')
+        self._size += len(line) + 1
+
+    def flush(self):
+        ''' Send the buffered actions. '''
+        if self._ndocs == 0:
+            return
+        data = ''.join(self._parts)
+        self._parts = []
+        self._size = 0
+        self._ndocs = 0
+        self.flushes += 1
+        self.flush_fn(data)
+
+
+class BulkIndexer(object):
+    ''' Send bulk API chunks to Elastic from a pool of sender threads. An error
+    raised by a chunk callback does not stop the senders; the first one is
+    raised by L{add} and L{close}. '''
+
+    THREADS = 2
+    QUEUE_SIZE = 4
+    # tells a sender thread to stop
+    _STOP = object()
+
+    def __init__(self, idx, idx_type, threads=THREADS, queue_size=QUEUE_SIZE, elastic_url=None):
+        ''' Start the sender threads.
+        @type  idx: string
+        @param idx: Index to load.
+        @type  idx_type: string
+        @param idx_type: Index type to load.
+        @type  threads: integer
+        @keyword threads: Number of sender threads.
+        @type  queue_size: integer
+        @keyword queue_size: Number of chunks queued before L{add} blocks.
+        @type  elastic_url: string
+        @keyword elastic_url: Elastic URL (default: default cluster URL).
+        '''
+        self.idx = idx
+        self.idx_type = idx_type
+        self.elastic_url = elastic_url
+        self.accepted = 0
+        self.failed = 0
+        self.chunks = 0
+        self.error = None
+        self._queue = queue.Queue(maxsize=max(queue_size, 1))
+        self._lock = threading.Lock()
+        self._senders = []
+        for i in range(max(threads, 1)):
+            sender = threading.Thread(target=self._send, name='elastic-bulk-'+str(i))
+            sender.daemon = True
+            sender.start()
+            self._senders.append(sender)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def add(self, json_data, callback=None):
+        ''' Queue a chunk of bulk API data, blocking while the queue is full.
+        The optional callback is called with the number of documents accepted
+        and failed once the chunk has been loaded. '''
+        if json_data is None or json_data.strip() == '':
+            return
+        if len(self._senders) == 0:
+            raise RuntimeError("bulk indexer is closed")
+        if self.error is not None:
+            raise self.error
+        self._queue.put((json_data, callback))
+
+    def close(self):
+        ''' Wait for the queued chunks to be sent and stop the sender threads. '''
+        for _ in self._senders:
+            self._queue.put(BulkIndexer._STOP)
+        for sender in self._senders:
+            sender.join()
+        self._senders = []
+        logger.info("Bulk loaded "+self.idx+"/"+self.idx_type+": "+str(self.accepted)+" accepted, " +
+                    str(self.failed)+" failed")
+        if self.error is not None:
+            raise self.error
+
+    def stats(self):
+        ''' Return the number of chunks sent and documents accepted and failed. '''
+        with self._lock:
+            return {"chunks": self.chunks, "accepted": self.accepted, "failed": self.failed}
+
+    def _send(self):
+        while True:
+            chunk = self._queue.get()
+            if chunk is BulkIndexer._STOP:
+                return
+            (json_data, callback) = chunk
+            try:
+                (accepted, failed) = Bulk.load_chunk(self.idx, self.idx_type, json_data,
+                                                     elastic_url=self.elastic_url)
+            except Exception as e:
+                logger.error("ERROR: bulk load of "+self.idx+" failed: "+str(e))
+                (accepted, failed) = (0, Bulk.count_actions(json_data))
+            with self._lock:
+                self.chunks += 1
+                self.accepted += accepted
+                self.failed += failed
+            if callback is not None:
+                try:
+                    callback(accepted, failed)
+                except Exception as e:
+                    logger.error("ERROR: bulk load of "+self.idx+" callback failed: "+str(e))
+                    with self._lock:
+                        if self.error is None:
+                            self.error = e
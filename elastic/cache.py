@@ -0,0 +1,227 @@
+''' Opt-in cache for search responses.
+
+Responses of L{Search.get_json_response} (and so L{Search.search}) are
+cached when a 'CACHE' is defined in the ELASTIC settings, I{e.g.}::
+
+    ELASTIC = {
+        'default': {
+            'ELASTIC_URL': 'http://127.0.0.1:9200/',
+            'CACHE': {
+                'MAX_SIZE': 1000,      # entries kept in the in-process LRU
+                'TTL': 300,            # seconds an entry is valid for
+                'BACKEND': None,       # or a shared Django cache alias (see CACHES)
+            },
+        }
+    }
+
+If 'BACKEND' names a Django cache (I{e.g.} 'default') then that is used to
+store the responses instead of the in-process LRU so that worker processes
+share the cache.
+
+Each index has a generation counter that is part of the cache key. Writes
+(bulk loads, updates, deletes, mappings and refreshes) call
+L{SearchCache.invalidate} to bump the generation of the index written to,
+so that only the cached responses for that index are invalidated. The
+aliases of the index and the indices of an alias are bumped too, as
+searches are cached under the name they were made with.
+
+Without a 'BACKEND' the generations are kept in the memory of each process,
+so writes made by another process (I{e.g.} the index_search and bulk_updates
+management commands) do not invalidate the responses cached by the web
+workers, which are then served until the TTL expires. Use a shared Django
+cache (I{e.g.} memcached or redis) as the 'BACKEND' if indices are written
+to while the site is running.
+'''
+import hashlib
+import json
+import threading
+import time
+import logging
+import requests
+from collections import OrderedDict
+from elastic.elastic_settings import ElasticSettings
+from elastic.transport import Transport
+
+# Get an instance of a logger
+logger = logging.getLogger(__name__)
+
+
+class SearchCache(object):
+    ''' LRU cache with a time to live for search responses. '''
+
+    CACHES = {}
+    KEY_PREFIX = 'elastic:'
+    GENERATION_PREFIX = 'elastic:generation:'
+    # generation bumped by every write, used for searches across all indices
+    ANY_IDX = '*'
+    # generation bumped when the index written to is not known
+    EPOCH = ''
+    _lock = threading.Lock()
+
+    def __init__(self, max_size=1000, ttl=300, backend=None):
+        ''' Set up the cache.
+        @type  max_size: integer
+        @keyword max_size: Maximum number of entries in the in-process LRU.
+        @type  ttl: float
+        @keyword ttl: Seconds a cached response is valid for.
+        @type  backend: string
+        @keyword backend: Django cache alias used to store responses (default: None).
+        '''
+        self.max_size = max_size
+        self.ttl = ttl
+        self.backend = backend
+        self.hits = 0
+        self.misses = 0
+        self._lru = OrderedDict()
+        self._lru_lock = threading.Lock()
+        self._generations = {}
+
+    @classmethod
+    def get_cache(cls, cluster='default'):
+        ''' Return the cache for a cluster or None if no cache is configured. '''
+        cache_settings = ElasticSettings.getattr('CACHE', cluster=cluster)
+        if not cache_settings:
+            return None
+        max_size = cache_settings.get('MAX_SIZE', 1000)
+        ttl = cache_settings.get('TTL', 300)
+        backend = cache_settings.get('BACKEND')
+        key = (cluster, max_size, ttl, backend)
+        cache = SearchCache.CACHES.get(key)
+        if cache is None:
+            with SearchCache._lock:
+                cache = SearchCache.CACHES.get(key)
+                if cache is None:
+                    cache = cls(max_size=max_size, ttl=ttl, backend=backend)
+                    SearchCache.CACHES[key] = cache
+        return cache
+
+    @classmethod
+    def invalidate(cls, idx, cluster='default'):
+        ''' Invalidate the cached responses for an index (or comma separated
+        indices) after it has been written to, and for the aliases of the index
+        or the indices of the alias. '''
+        cache = cls.get_cache(cluster=cluster)
+        if cache is not None:
+            names = cls._idx_names(idx)
+            cache.bump_generation(','.join(sorted(set(names + cls._alias_names(names, cluster)))))
+
+    @classmethod
+    def _alias_names(cls, names, cluster='default'):
+        ''' Return the indices and aliases related to the index names through
+        an alias. '''
+        if len(names) == 0 or any('*' in name or name == '_all' for name in names):
+            return []
+        url = ElasticSettings.url(cluster=cluster) + '/' + ','.join(names) + '/_alias'
+        try:
+            resp = Transport.get_transport(cluster=cluster).get(url)
+        except requests.exceptions.RequestException:
+            return []
+        if resp.status_code != 200:
+            return []
+        alias_names = []
+        for idx, idx_aliases in resp.json().items():
+            alias_names.append(idx)
+            alias_names.extend(idx_aliases.get('aliases', {}).keys())
+        return alias_names
+
+    def search_key(self, search):
+        ''' Return the cache key for a L{Search}, based on the canonical JSON of
+        the query, the index, type, size and from and the index generations. '''
+        key = json.dumps({"query": getattr(search, 'query', None),
+                          "idx": search.idx,
+                          "idx_type": search.idx_type,
+                          "size": search.size,
+                          "from": search.search_from,
+                          "search_type": search.search_type,
+                          "generation": self.generations(search.idx)},
+                         sort_keys=True, separators=(',', ':'))
+        return SearchCache.KEY_PREFIX + hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+    @classmethod
+    def _idx_names(cls, idx):
+        ''' Return the index names in a (comma separated) index string. '''
+        if idx is None:
+            return []
+        return [name.split('/')[0].strip() for name in idx.split(',') if name.split('/')[0].strip() != '']
+
+    def generations(self, idx):
+        ''' Return the generations of the indices searched. '''
+        names = SearchCache._idx_names(idx)
+        if len(names) == 0 or any('*' in name or name == '_all' for name in names):
+            names.append(SearchCache.ANY_IDX)
+        names.append(SearchCache.EPOCH)
+        return [self.generation(name) for name in sorted(set(names))]
+
+    def generation(self, name):
+        ''' Return the generation of an index. '''
+        if self.backend is not None:
+            return self._backend().get(SearchCache.GENERATION_PREFIX + name, 0)
+        return self._generations.get(name, 0)
+
+    def bump_generation(self, idx):
+        ''' Bump the generation of the indices written to. If the index is
+        not known all cached responses are invalidated. '''
+        names = SearchCache._idx_names(idx)
+        names.append(SearchCache.ANY_IDX if len(names) > 0 else SearchCache.EPOCH)
+        for name in names:
+            if self.backend is not None:
+                backend = self._backend()
+                key = SearchCache.GENERATION_PREFIX + name
+                backend.add(key, 0, timeout=None)
+                try:
+                    backend.incr(key)
+                except ValueError:
+                    backend.set(key, 1, timeout=None)
+            else:
+                with self._lru_lock:
+                    self._generations[name] = self._generations.get(name, 0) + 1
+        logger.debug("Cache generation bumped for " + str(names))
+
+    def _backend(self):
+        from django.core.cache import caches
+        return caches[self.backend]
+
+    def get(self, key):
+        ''' Return the cached value or None. '''
+        if self.backend is not None:
+            value = self._backend().get(key)
+        else:
+            with self._lru_lock:
+                entry = self._lru.get(key)
+                value = None
+                if entry is not None:
+                    if entry[0] > time.time():
+                        self._lru.move_to_end(key)
+                        value = entry[1]
+                    else:
+                        del self._lru[key]
+
+        with self._lru_lock:
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return value
+
+    def set(self, key, value):
+        ''' Cache a value, evicting the least recently used entry if full. '''
+        if self.backend is not None:
+            self._backend().set(key, value, timeout=self.ttl)
+            return
+        with self._lru_lock:
+            self._lru[key] = (time.time() + self.ttl, value)
+            self._lru.move_to_end(key)
+            while len(self._lru) > self.max_size:
+                self._lru.popitem(last=False)
+
+    def clear(self):
+        ''' Remove the in-process entries and reset the counters. A shared
+        Django cache backend is left untouched. '''
+        with self._lru_lock:
+            self._lru.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def stats(self):
+        ''' Return the hit and miss counters. '''
+        return {"hits": self.hits, "misses": self.misses, "size": len(self._lru)}
@@ -1,6 +1,7 @@
 ''' Used to manage and retrieve Elastic settings. '''
 from django.conf import settings
 from elastic.exceptions import SettingsError
+from elastic.node_pool import NodePool
 import logging
 # Get an instance of a logger
 logger = logging.getLogger(__name__)
@@ -145,31 +146,29 @@ class ElasticSettings:
 
 
 class ElasticUrl(object):
-    ''' Manage elastic urls settings. '''
-    URL_INDEX = 0
+    ''' Manage elastic urls settings. When more than one URL is defined
+    a L{NodePool} is used to select a healthy node. '''
 
     @classmethod
     def get_url(cls, cluster='default'):
         urls = ElasticSettings.getattr('ELASTIC_URL', cluster=cluster)
         if isinstance(urls, str):
             return urls
-        try:
-            return urls[ElasticUrl.URL_INDEX]
-        except IndexError:
-            ElasticUrl.URL_INDEX = 0
-            return urls[ElasticUrl.URL_INDEX]
+        return ElasticUrl.get_pool(cluster=cluster).select()
 
     @classmethod
-    def rotate_url(cls, cluster='default'):
-        ''' Rotate the host used in an array of elastic urls. '''
+    def get_pool(cls, cluster='default'):
+        ''' Return the L{NodePool} for the list of elastic urls of a cluster. '''
         urls = ElasticSettings.getattr('ELASTIC_URL', cluster=cluster)
         if isinstance(urls, str):
-            logger.warn("Just one elastic url (ELASTIC_URL) defined.")
-            return
-
-        logger.debug("Rotate old HOST_INDEX = "+str(ElasticUrl.URL_INDEX))
-        if len(urls) <= (ElasticUrl.URL_INDEX+1):
-            ElasticUrl.URL_INDEX = 0
-        else:
-            ElasticUrl.URL_INDEX += 1
-        logger.debug("Rotate new HOST_INDEX = "+str(ElasticUrl.URL_INDEX))
+            urls = [urls]
+        return NodePool.get_pool(urls,
+                                 selector=ElasticSettings.getattr('NODE_SELECTOR', cluster=cluster,
+                                                                  default=NodePool.ROUND_ROBIN),
+                                 cooldown=ElasticSettings.getattr('NODE_COOLDOWN', cluster=cluster, default=30),
+                                 max_failures=ElasticSettings.getattr('NODE_MAX_FAILURES', cluster=cluster,
+                                                                      default=1),
+                                 max_error_rate=ElasticSettings.getattr('NODE_MAX_ERROR_RATE', cluster=cluster,
+                                                                        default=0.5),
+                                 probe_interval=ElasticSettings.getattr('NODE_PROBE_INTERVAL', cluster=cluster,
+                                                                        default=5))
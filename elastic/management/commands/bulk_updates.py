@@ -14,6 +14,7 @@ class Command(BaseCommand):
     help = "Use to update Elastic index\n\n" \
            "Options:\n" \
            " --indexName [index name] --indexType [index type] --json_data [file with json data to add] " \
+           "[--slices [number of parallel scrolls]] [--update_by_query] [--query [JSON query]] " \
 
     option_list = BaseCommand.option_list + (
         make_option('--update',
@@ -37,6 +38,45 @@ class Command(BaseCommand):
         make_option('--json_data',
                     dest='json_data',
                     help='JSON data'),
+        ) + (
+        make_option('--update_by_query',
+                    dest='update_by_query',
+                    help='update the documents on the cluster (Elastic 5+)',
+                    action="store_true"),
+        ) + (
+        make_option('--query',
+                    dest='query',
+                    help='Query (JSON) selecting the documents to update [default: all]'),
+        ) + (
+        make_option('--slices',
+                    dest='slices',
+                    type='int',
+                    default=1,
+                    help='Number of parallel sliced scrolls (Elastic 5+)'),
+        ) + (
+        make_option('--bulkThreads',
+                    dest='bulkThreads',
+                    type='int',
+                    default=2,
+                    help='No. of threads sending bulk requests [default: %default]'),
+        ) + (
+        make_option('--bulkQueue',
+                    dest='bulkQueue',
+                    type='int',
+                    default=4,
+                    help='No. of bulk requests queued for the sending threads [default: %default]'),
+        ) + (
+        make_option('--bulkBytes',
+                    dest='bulkBytes',
+                    type='int',
+                    default=5000000,
+                    help='Bulk request size that triggers a request [default: %default]'),
+        ) + (
+        make_option('--bulkDocs',
+                    dest='bulkDocs',
+                    type='int',
+                    default=5000,
+                    help='No. of documents that triggers a bulk request [default: %default]'),
         )
 
     def handle(self, *args, **options):
@@ -46,7 +86,7 @@ class Command(BaseCommand):
             logger.debug('indexType : ' + str(options['indexType']))
             logger.debug('json_data: ' + str(options['json_data']))
 
-            updatemgr = UpdateManager()
+            updatemgr = UpdateManager(**options)
             updatemgr.update_idx(**options)
         else:
             print(help)
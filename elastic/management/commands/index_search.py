@@ -1,5 +1,5 @@
 ''' Used to define Elastic mapping and index data. '''
-from django.core.management.base import BaseCommand
+from django.core.management.base import BaseCommand, CommandError
 from optparse import make_option
 import logging
 from elastic.management.loaders.marker import MarkerManager, RsMerge
@@ -11,6 +11,7 @@ from elastic.management.loaders.bed import BEDManager
 from elastic.management.loaders.alias import AliasManager
 from elastic.management.loaders.criteria import CriteriaManager
 from elastic.management.loaders.json import JsonManager
+from elastic.management.reindex import Reindex
 
 
 # Get an instance of a logger
@@ -25,7 +26,7 @@ class Command(BaseCommand):
            " --indexName [index name] --indexSNPMerge RsMergeArch.bcp.gz\n" \
            "Options for genes:\n" \
            " --indexName [index name] --indexGene genenames.org.txt --org=human\n" \
-           " --indexName [index name] --indexGeneGFF gene.gff --build GRCh38\n" \
+           " --indexName [index name] --indexGeneGFF gene.gff --build GRCh38 [--preloadGenes]\n" \
            "Options for diseases:\n" \
            " --indexName [index name] --indexDisease disease.list\n" \
            "Options for GFF/GTF:\n" \
@@ -37,9 +38,14 @@ class Command(BaseCommand):
            "Options for imb/criteria:\n" \
            " indexCriteria 'true' --indexName [index name] --indexProject immunobase --applyFilter" \
            "Options for alias/gene:\n" \
-           " --indexAlias [dir where files to be indexed are there] --indexFeatureType gene" \
+           " --indexAlias [dir where files to be indexed are there] --indexFeatureType gene\n" \
+           "Options for a zero-downtime rebuild (the index name becomes an alias):\n" \
+           " --reindex [--minDocs 1000] [--keepGenerations 1]" \
 
 
+    # options that update or alias existing indices so cannot be reindexed
+    IN_PLACE = ('indexGeneGFF', 'indexAlias', 'indexCriteria')
+
     option_list = BaseCommand.option_list + (
         make_option('--indexSNP',
                     dest='indexSNP',
@@ -57,6 +63,11 @@ class Command(BaseCommand):
                     dest='indexGeneGFF',
                     help='GFF gene file used to update a gene index'),
         ) + (
+        make_option('--preloadGenes',
+                    dest='preloadGenes',
+                    help='Look up --indexGeneGFF genes in a copy of the gene index held in memory',
+                    action="store_true"),
+        ) + (
         make_option('--org',
                     dest='org',
                     help='Organism name'),
@@ -106,10 +117,25 @@ class Command(BaseCommand):
                     dest='indexAlias',
                     help='Load aliases'),
         ) + (
+        make_option('--concurrency',
+                    dest='concurrency',
+                    type='int',
+                    default=1,
+                    help='No. of alias files loaded at the same time [default: %default]'),
+        ) + (
         make_option('--indexProject',
                     help='Project name to use',
                     action="store", type="string", dest='indexProject'),
         ) + (
+        make_option('--martUrl',
+                    dest='martUrl',
+                    help='BioMart martservice URL [default: https://mart.[project].org/biomart/martservice]'),
+        ) + (
+        make_option('--martProcessor',
+                    dest='martProcessor',
+                    default='JSON',
+                    help='BioMart results format (JSON or TSV) [default: %default]'),
+        ) + (
         make_option('--applyFilter',
                     help='applyFilter enabled to restrict query for testing',
                     action="store_true"),
@@ -126,51 +152,141 @@ class Command(BaseCommand):
                     dest='shards',
                     default=5,
                     help='No. of shards [default: %default]'),
+        ) + (
+        make_option('--bulkThreads',
+                    dest='bulkThreads',
+                    type='int',
+                    default=2,
+                    help='No. of threads sending bulk requests [default: %default]'),
+        ) + (
+        make_option('--bulkQueue',
+                    dest='bulkQueue',
+                    type='int',
+                    default=4,
+                    help='No. of bulk requests queued for the sending threads [default: %default]'),
+        ) + (
+        make_option('--bulkBytes',
+                    dest='bulkBytes',
+                    type='int',
+                    default=5000000,
+                    help='Bulk request size that triggers a request [default: %default]'),
+        ) + (
+        make_option('--bulkDocs',
+                    dest='bulkDocs',
+                    type='int',
+                    default=5000,
+                    help='No. of documents that triggers a bulk request [default: %default]'),
+        ) + (
+        make_option('--processes',
+                    dest='processes',
+                    type='int',
+                    default=1,
+                    help='No. of processes parsing delimited files [default: %default]'),
+        ) + (
+        make_option('--fastIngest',
+                    dest='fastIngest',
+                    help='Turn off refreshes and replicas while loading',
+                    action="store_true"),
+        ) + (
+        make_option('--maxSegments',
+                    dest='maxSegments',
+                    type='int',
+                    help='Force merge to this number of segments after a fast ingest'),
+        ) + (
+        make_option('--resume',
+                    dest='resume',
+                    help='Resume a failed load from its checkpoint (not with --reindex)',
+                    action="store_true"),
+        ) + (
+        make_option('--checkpoint',
+                    dest='checkpoint',
+                    help='Checkpoint file, suffixed with .[index name]_[index type] for each alias file '
+                         '[default: [index name]_[index type].checkpoint]'),
+        ) + (
+        make_option('--reindex',
+                    dest='reindex',
+                    help='Load a new version of the index and move the index name alias to it',
+                    action="store_true"),
+        ) + (
+        make_option('--minDocs',
+                    dest='minDocs',
+                    type='int',
+                    default=1,
+                    help='Minimum no. of documents in a reindexed index [default: %default]'),
+        ) + (
+        make_option('--keepGenerations',
+                    dest='keepGenerations',
+                    type='int',
+                    help='No. of old index versions kept after a reindex [default: all]'),
         )
 
     def handle(self, *args, **options):
-        ''' Handle the user options to map or load data. '''
-        if options['indexSNP']:
-            marker = MarkerManager()
-            marker.create_load_snp_index(**options)
-        elif options['indexSNPMerge']:
-            marker_merge = RsMerge()
-            marker_merge.create_load_snp_merge_index(**options)
-
-        elif options['indexGene']:
-            gene = GeneManager()
-            gene.load_genename(**options)
-        elif options['indexGeneGFF']:
-            gene = GeneManager()
-            gene.update_gene(**options)
-
-        elif options['indexDisease']:
-            disease = DiseaseManager()
-            disease.create_disease(**options)
-
-        elif options['indexGTarget']:
-            gt = GeneTargetManager()
-            gt.create_load_gene_target_index(**options)
-
-        elif options['indexGFF']:
-            gff = GFFManager()
-            gff.create_load_gff_index(**options)
-
-        elif options['indexBED']:
-            bed = BEDManager()
-            bed.create_load_bed_index(**options)
-
-        elif options['indexAlias']:
-            alias = AliasManager()
-            alias.create_alias(**options)
-
-        elif options['indexCriteria']:
-            criteria = CriteriaManager()
-            criteria.create_criteria(**options)
-
-        elif options['indexJson']:
-            json = JsonManager()
-            json.load_json(**options)
-
-        else:
-            print(help)
+        ''' Handle the user options to map or load data. With the reindex option
+        the data is loaded into a new version of the index which then replaces
+        the current one (see L{Reindex}). '''
+        alias = None
+        if options.get('reindex'):
+            if not options['indexName'] or any(options.get(o) for o in Command.IN_PLACE):
+                raise CommandError("--reindex needs --indexName and a loader that creates the index")
+            if options.get('resume'):
+                # each reindex loads into a new generation so there is nothing to resume
+                raise CommandError("--resume cannot be used with --reindex")
+            alias = options['indexName'].lower()
+            options['indexName'] = Reindex.generation_name(alias)
+            options['fastIngest'] = True
+            logger.info("Reindexing "+alias+" into "+options['indexName'])
+
+        loader = None
+        try:
+            if options['indexSNP']:
+                loader = MarkerManager(**options)
+                loader.create_load_snp_index(**options)
+            elif options['indexSNPMerge']:
+                loader = RsMerge(**options)
+                loader.create_load_snp_merge_index(**options)
+
+            elif options['indexGene']:
+                loader = GeneManager(**options)
+                loader.load_genename(**options)
+            elif options['indexGeneGFF']:
+                loader = GeneManager(**options)
+                loader.update_gene(**options)
+
+            elif options['indexDisease']:
+                loader = DiseaseManager(**options)
+                loader.create_disease(**options)
+
+            elif options['indexGTarget']:
+                loader = GeneTargetManager(**options)
+                loader.create_load_gene_target_index(**options)
+
+            elif options['indexGFF']:
+                loader = GFFManager(**options)
+                loader.create_load_gff_index(**options)
+
+            elif options['indexBED']:
+                loader = BEDManager(**options)
+                loader.create_load_bed_index(**options)
+
+            elif options['indexAlias']:
+                loader = AliasManager(**options)
+                loader.create_alias(**options)
+
+            elif options['indexCriteria']:
+                loader = CriteriaManager(**options)
+                loader.create_criteria(**options)
+
+            elif options['indexJson']:
+                loader = JsonManager(**options)
+                loader.load_json(**options)
+
+            else:
+                print(help)
+        finally:
+            # restore index settings changed for a fast ingest, even if the load failed
+            if loader is not None:
+                loader.finish_ingest()
+
+        if alias is not None:
+            Reindex.publish(alias, options['indexName'], min_docs=options.get('minDocs') or 1,
+                            keep=options.get('keepGenerations'))
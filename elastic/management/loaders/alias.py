@@ -1,16 +1,22 @@
 from elastic.management.loaders.loader import DelimeterLoader, MappingProperties
 import re
 import os
+import time
 import logging
+from concurrent.futures import ThreadPoolExecutor
 
 # Get an instance of a logger
 logger = logging.getLogger(__name__)
 
 
 class AliasManager(DelimeterLoader):
+    ''' Load the alias files of each object type. The mappings are put first and
+    the files are then loaded concurrently (see the concurrency option), each
+    by its own loader. '''
 
     def create_alias(self, **options):
-        ''' Create alias index mapping and load data '''
+        ''' Create alias index mapping and load data. Returns the file, number of
+        documents loaded and time taken for each alias file. '''
         idx_name = None
         root_dir = None
         idx_feature_type = None
@@ -23,6 +29,7 @@ class AliasManager(DelimeterLoader):
             idx_feature_type = options['indexFeatureType']
 
         object_types = ['gene', 'locus', 'marker', 'study']
+        alias_files = []
         for object_ in object_types:
             idx_dir = object_ + '_alias'
 
@@ -47,17 +54,43 @@ class AliasManager(DelimeterLoader):
                     idx_file = root_dir + '/' + idx_dir + '/' + type_ + '.tsv'
 
                 if (os.path.exists(root_dir) and os.path.exists(idx_file)):
-                    options['indexAlias'] = idx_file
-                    options['indexType'] = type_
-                    options['indexName'] = idx_name_cur
-                    self._create_alias_mapping(type_, **options)
-                    f = self.open_file_to_load('indexAlias', **options)
-                    column_names = ["internal_id", "alias", "preferred_name", "type"]
-                    self.load(column_names, f, idx_name_cur, type_)
-                    logger.warn('Index created for ' + type_ + ' with index name ' + idx_name_cur)
+                    alias_files.append((idx_name_cur, type_, idx_file))
                 else:
                     logger.warn(idx_file + ' Does not Exists ..... Proceeding to quit')
 
+        # put all the mappings before loading the files
+        for idx_name_cur, type_, idx_file in alias_files:
+            self._create_alias_mapping(type_, **dict(options, indexName=idx_name_cur, indexType=type_))
+
+        concurrency = int(options.get('concurrency') or 1)
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            loads = [executor.submit(self._load_alias_file, idx_name_cur, type_, idx_file, **options)
+                     for idx_name_cur, type_, idx_file in alias_files]
+            stats = [load.result() for load in loads]
+
+        print('\n%-30s %10s %10s' % ('file', 'docs', 'docs/s'))
+        for idx_file, ndocs, secs in stats:
+            print('%-30s %10d %10.0f' % (os.path.relpath(idx_file, root_dir), ndocs, ndocs / secs if secs > 0 else 0))
+        print('%-30s %10d' % ('total', sum(ndocs for _f, ndocs, _secs in stats)))
+        return stats
+
+    def _load_alias_file(self, idx_name, idx_type, idx_file, **options):
+        ''' Load an alias file and return the file, number of documents loaded
+        and time taken. The file is loaded by a new loader as the load position,
+        stats and bulk indexers of a loader are not shared between loads. Each
+        file has its own checkpoint, named after the checkpoint option and the
+        index and type loaded. '''
+        start = time.time()
+        if self.checkpoint_file is not None:
+            options = dict(options, checkpoint=self.checkpoint_file + '.' + idx_name + '_' + idx_type)
+        loader = self.__class__(**options)
+        loader.mapping_json = self.mapping_json
+        column_names = ["internal_id", "alias", "preferred_name", "type"]
+        with loader.open_file_to_load('indexAlias', **dict(options, indexAlias=idx_file)) as f:
+            ndocs = loader.load(column_names, f, idx_name, idx_type)
+        logger.warn('Index created for ' + idx_type + ' with index name ' + idx_name)
+        return (idx_file, ndocs, time.time() - start)
+
     def _create_alias_mapping(self, idx_alias_type, **options):
         ''' Create the mapping for alias indexing '''
         props = MappingProperties(idx_alias_type)
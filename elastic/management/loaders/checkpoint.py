@@ -0,0 +1,100 @@
+''' Checkpoints used to resume a load that has failed part way through. '''
+import json
+import os
+import threading
+import logging
+from elastic.management.loaders.exceptions import LoaderError
+
+# Get an instance of a logger
+logger = logging.getLogger(__name__)
+
+
+class Checkpoint(object):
+    ''' Record the position in the input file up to which all the bulk chunks
+    have been acknowledged. Chunks can be acknowledged out of order (by the
+    bulk sender threads) so the checkpoint only advances once every earlier
+    chunk has also been acknowledged. Chunks with failed documents do not stop
+    it advancing; their lines are recorded in the file (the failed documents
+    are also in the BULK_DEAD_LETTER file if set) and it is kept after the load.
+    The file is written atomically. '''
+
+    def __init__(self, file_name, idx_name, idx_type):
+        ''' Set up the checkpoint.
+        @type  file_name: string
+        @param file_name: Checkpoint file.
+        @type  idx_name: string
+        @param idx_name: Index being loaded.
+        @type  idx_type: string
+        @param idx_type: Index type being loaded.
+        '''
+        self.file_name = file_name
+        self.idx_name = idx_name
+        self.idx_type = idx_type
+        self._positions = {}
+        self._acknowledged = set()
+        self._next_chunk = 0
+        self._next_ack = 0
+        self._last_line = 0
+        self.failed = []
+        self._lock = threading.Lock()
+
+    def position(self):
+        ''' Return the (line, last id) recorded by a previous load, or (0, 0) if
+        there is no checkpoint. '''
+        if not os.path.exists(self.file_name):
+            return (0, 0)
+        with open(self.file_name) as f:
+            checkpoint = json.load(f)
+        if checkpoint['index'] != self.idx_name or checkpoint['type'] != self.idx_type:
+            raise LoaderError("checkpoint "+self.file_name+" is for "+checkpoint['index']+"/"+checkpoint['type'])
+        logger.info("Resuming "+self.idx_name+"/"+self.idx_type+" after line "+str(checkpoint['line']))
+        self._last_line = checkpoint['line']
+        self.failed = checkpoint.get('failed', [])
+        if len(self.failed) > 0:
+            logger.warn("WARNING: lines not loaded by the previous load: "+self._ranges())
+        return (checkpoint['line'], checkpoint['id'])
+
+    def sent(self, line, last_id):
+        ''' Register a chunk ending at a line and id and return its chunk number. '''
+        with self._lock:
+            chunk = self._next_chunk
+            self._next_chunk += 1
+            self._positions[chunk] = (self._last_line, line, last_id)
+            self._last_line = line
+            return chunk
+
+    def acknowledged(self, chunk, ok=True):
+        ''' Record that a chunk has been loaded. If some of its documents
+        failed its lines are added to the failed lines. '''
+        with self._lock:
+            self._acknowledged.add(chunk)
+            if not ok:
+                (first_line, line, _last_id) = self._positions[chunk]
+                self.failed.append([first_line + 1, line])
+            position = None
+            while self._next_ack in self._acknowledged:
+                self._acknowledged.remove(self._next_ack)
+                position = self._positions.pop(self._next_ack)
+                self._next_ack += 1
+            if position is not None:
+                self._save(*position[1:])
+
+    def _ranges(self):
+        return ', '.join(str(first_line)+'-'+str(line) for first_line, line in self.failed)
+
+    def _save(self, line, last_id):
+        tmp_file = self.file_name + '.tmp'
+        with open(tmp_file, 'w') as f:
+            json.dump({"index": self.idx_name, "type": self.idx_type, "line": line, "id": last_id,
+                       "failed": sorted(self.failed)}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_file, self.file_name)
+
+    def remove(self):
+        ''' Remove the checkpoint once the load has completed, unless it
+        records failed lines. '''
+        if len(self.failed) > 0:
+            logger.warn("WARNING: lines not loaded: "+self._ranges()+" (see "+self.file_name+")")
+        elif os.path.exists(self.file_name):
+            os.remove(self.file_name)
@@ -1,4 +1,7 @@
+from concurrent.futures import ThreadPoolExecutor
 from elastic.management.loaders.loader import JSONLoader, MappingProperties
+from elastic.management.loaders.exceptions import LoaderError
+from elastic.stream import JsonStream
 import requests
 import logging
 
@@ -7,26 +10,35 @@ logger = logging.getLogger(__name__)
 
 
 class CriteriaManager(JSONLoader):
+    ''' Load criteria from BioMart. The rows of the BioMart results are streamed
+    (in JSON or TSV) into the bulk loader and the index types are fetched
+    concurrently. '''
+
+    MART_PROCESSORS = ('JSON', 'TSV')
+    READ_SIZE = 65536
 
     def create_criteria(self, **options):
         ''' Create alias index mapping and load data '''
         idx_name = self.get_index_name(**options)
         idx_types = self.get_index_type(**options)
         mart_project = self.get_project(**options)
-
-        for idx_type in idx_types:
-            logger.warn('idx name ' + idx_name)
-            logger.warn('idx_type' + idx_type)
-            logger.warn('project name ' + mart_project)
-            mart_url = 'https://mart.' + mart_project + '.org/biomart/martservice?'
-            # mart_url = 'https://mart-dev-imb/biomart/martservice?'
-            mart_object = self.get_object_type(idx_type)
-            logger.warn('mart_project ' + mart_project + '  mart_object ' + mart_object)
-            mart_dataset = mart_project + '_criteria_' + mart_object
-            criteria_json = self.get_criteria_info_from_biomart(mart_url, mart_dataset, idx_type, **options)
-            processed_criteria_json = self._post_process_criteria_info(criteria_json, **options)
-            self._create_criteria_mapping(**options)
-            self.load(processed_criteria_json, idx_name, idx_type)
+        mart_url = self.get_mart_url(**options)
+        logger.info('idx name ' + idx_name + ' project name ' + mart_project + ' mart ' + mart_url)
+
+        self._create_criteria_mapping(**options)
+        with ThreadPoolExecutor(max_workers=len(idx_types)) as executor:
+            loads = [executor.submit(self._load_criteria, mart_url, mart_project, idx_name, idx_type, **options)
+                     for idx_type in idx_types]
+            for load in loads:
+                load.result()
+
+    def _load_criteria(self, mart_url, mart_project, idx_name, idx_type, **options):
+        ''' Stream the criteria for an index type from BioMart into the index. '''
+        mart_object = self.get_object_type(idx_type)
+        mart_dataset = mart_project + '_criteria_' + mart_object
+        logger.info('mart_project ' + mart_project + '  mart_object ' + mart_object)
+        rows = self.iter_criteria_from_biomart(mart_url, mart_dataset, idx_type, **options)
+        self.load((self.process_row(row, **options) for row in rows), idx_name, idx_type)
 
     def _create_criteria_mapping(self, **options):
         ''' Create the mapping for alias indexing '''
@@ -36,13 +48,6 @@ class CriteriaManager(JSONLoader):
             props = self.get_properties(idx_type, **options)
             self.mapping(props, idx_type=idx_type, meta=None, analyzer=self.KEYWORD_ANALYZER, **options)
 
-    def _post_process_criteria_info(self, criteria_json, **options):
-        doc = []
-        for row in criteria_json['data']:
-            current_row = self.process_row(row, **options)
-            doc.append(current_row)
-        return doc
-
     def process_row(self, row, **options):
         current_row = {}
         current_row['Name'] = row['Name']
@@ -145,11 +150,28 @@ class CriteriaManager(JSONLoader):
         else:
             return "immunobase"
 
-    def get_criteria_info_from_biomart(self, mart_url, mart_dataset, idx_type, **options):
+    def get_mart_url(self, **options):
+        ''' Return the BioMart martservice URL. '''
+        if options.get('martUrl'):
+            mart_url = options['martUrl']
+            return mart_url if mart_url.endswith('?') else mart_url + '?'
+        return 'https://mart.' + self.get_project(**options) + '.org/biomart/martservice?'
+
+    def get_mart_processor(self, **options):
+        ''' Return the BioMart output format (JSON or TSV). '''
+        processor = (options.get('martProcessor') or 'JSON').upper()
+        if processor not in CriteriaManager.MART_PROCESSORS:
+            raise LoaderError("BioMart processor not recognised: " + processor)
+        return processor
+
+    def iter_criteria_from_biomart(self, mart_url, mart_dataset, idx_type, **options):
+        ''' Query BioMart and yield each row of the results as a dictionary, as
+        the response is read. '''
+        processor = self.get_mart_processor(**options)
         urlTemplate = \
             mart_url + \
             'query=<?xml version="1.0" encoding="UTF-8"?>' \
-            '<!DOCTYPE Query><Query client="pythonclient" processor="JSON" limit="-1" header="1">' \
+            '<!DOCTYPE Query><Query client="pythonclient" processor="' + processor + '" limit="-1" header="1">' \
             '<Dataset name="' + mart_dataset + '" config="criteria_config">' \
             '<Attribute name="criteria__object__main__primary_id"/>' \
             '<Attribute name="criteria__object__main__name"/>' \
@@ -180,4 +202,16 @@ class CriteriaManager(JSONLoader):
         urlTemplate += '</Dataset>' + '</Query>'
         queryURL = urlTemplate
         req = requests.get(queryURL, stream=True, verify=False)
-        return req.json()
+        try:
+            if req.status_code != 200:
+                raise LoaderError("BioMart " + mart_dataset + " status: " + str(req.status_code))
+            if processor == 'JSON':
+                yield from JsonStream(req.iter_content(CriteriaManager.READ_SIZE), path=('data',))
+            else:
+                lines = (line.decode("utf-8") for line in req.iter_lines(CriteriaManager.READ_SIZE))
+                header = next(lines, '').split('\t')
+                for line in lines:
+                    if line != '':
+                        yield dict(zip(header, line.split('\t')))
+        finally:
+            req.close()
@@ -1,10 +1,7 @@
 ''' Loader for disease data. '''
 import re
-import requests
-import json
 from elastic.management.loaders.loader import Loader
 from elastic.management.loaders.mapping import MappingProperties
-from elastic.search import ElasticSettings
 import logging
 
 # Get an instance of a logger
@@ -19,27 +16,26 @@ class DiseaseManager(Loader):
         self._create_disease_mapping(**options)
 
         f = self.open_file_to_load('indexDisease', **options)
-        for line in f:
-            line = line.strip().decode("utf-8")
-            if line.startswith("#"):
-                continue
-            parts = re.split('\t', line)
-            data = {"name": parts[0],
-                    "code": parts[2].lower(),
-                    "description": parts[1],
-                    "colour": parts[3],
-                    "tier": int(parts[4])
-                    }
-            data['suggest'] = {}
-            data['suggest']["input"] = [parts[2].lower(), parts[0]]
-            data['suggest']["weight"] = 250
-            resp = requests.put(ElasticSettings.url()+'/' +
-                                index_name+'/disease/'+parts[2].lower(),
-                                data=json.dumps(data))
-            if resp.status_code == 201:
-                logger.debug("Loaded "+parts[0])
-            else:
-                logger.error("Problem loading "+parts[0])
+        with self.indexing(index_name, 'disease'), self.bulk_buffer(index_name, 'disease') as buf:
+            for line in f:
+                line = line.strip().decode("utf-8")
+                if line.startswith("#"):
+                    continue
+                parts = re.split('\t', line)
+                data = {"name": parts[0],
+                        "code": parts[2].lower(),
+                        "description": parts[1],
+                        "colour": parts[3],
+                        "tier": int(parts[4])
+                        }
+                data['suggest'] = {}
+                data['suggest']["input"] = [parts[2].lower(), parts[0]]
+                data['suggest']["weight"] = 250
+                buf.add({"index": {"_id": parts[2].lower()}}, data)
+
+        if self.bulk_stats['failed'] > 0:
+            logger.error("Problem loading "+str(self.bulk_stats['failed'])+" diseases")
+        logger.debug("Loaded "+str(self.bulk_stats['accepted'])+" diseases")
 
     def _create_disease_mapping(self, **options):
         ''' Create the mapping for disease indexing '''
@@ -1,11 +1,12 @@
 ''' Loader for gene data. '''
 import re
-from elastic.search import Search
+from functools import partial
+from elastic.search import Search, MultiSearch, ScanAndScroll, ElasticQuery
+from elastic.query import Query
 from elastic.management.loaders.loader import Loader
 from elastic.management.loaders.mapping import MappingProperties
 from elastic.management.loaders.utils import GFF
 import sys
-import json
 import logging
 
 # Get an instance of a logger
@@ -14,6 +15,9 @@ logger = logging.getLogger(__name__)
 
 class GeneManager(Loader):
 
+    # no. of GFF lines looked up together
+    LOOKUP_BATCH = 500
+
     def load_genename(self, **options):
         '''
         Create index based on genenames.org download file for names
@@ -38,10 +42,8 @@ class GeneManager(Loader):
                           "accession numbers", "locus type"]
         dbxrefColumns = ["entrez", "ensembl", "mgi", "refseq"]
         idx_n = 0
-        n = 0
-        data = ''
 
-        try:
+        with self.indexing(idx_name, 'gene'), self.bulk_buffer(idx_name, 'gene') as buf:
             for line in f:
                 line = line.rstrip().decode("utf-8")
                 parts = re.split('\t', line)
@@ -80,26 +82,19 @@ class GeneManager(Loader):
                             for syn in syns:
                                 synonym_data.append(syn.strip())
 
-                    data += '{"index": {"_id": "%s"}}\n' % idx_n
-                    data += json.dumps({"gene_symbol":
-                                        col_dict["approved symbol"],
-                                        "organism": org,
-                                        "hgnc": col_dict["hgnc id"][5:],
-                                        "dbxrefs": dbxref_data,
-                                        "synonyms": synonym_data
-                                        })+'\n'
+                    buf.add({"index": {"_id": str(idx_n)}},
+                            {"gene_symbol": col_dict["approved symbol"],
+                             "organism": org,
+                             "hgnc": col_dict["hgnc id"][5:],
+                             "dbxrefs": dbxref_data,
+                             "synonyms": synonym_data
+                             })
                     idx_n += 1
-                    n += 1
-
-                    if(n > 5000):
-                        n = 0
-                        self.bulk_load(idx_name, 'gene', data)
-                        data = ''
-        finally:
-            self.bulk_load(idx_name, 'gene', data)
 
     def update_gene(self, **options):
-        ''' Use gene span GFF coordinates to add coordinates '''
+        ''' Use gene span GFF coordinates to add coordinates. Genes are looked up
+        by symbol, then synonym, either in multi search batches or, with the
+        preloadGenes option, in dictionaries built by scrolling the gene index. '''
         idx_name = self.get_index_name(**options)
         if options['build']:
             build = options['build']
@@ -108,74 +103,99 @@ class GeneManager(Loader):
             sys.exit()
 
         f = self.open_file_to_load('indexGeneGFF', **options)
-        line_num = 0
-        auto_num = 1
-        json_data = ''
-        chunk = 1000
-
-        try:
-            for line in f:
-                line = line.decode("utf-8").rstrip()
-                if(line.startswith("##")):
-                    continue
-                gff = GFF(line)
-
-                context = self._call_elasticsearch(gff.attrs["Name"], ["gene_symbol"], idx_name)
-                if context["total"] != 1:
-                    context = self._call_elasticsearch(gff.attrs["Name"], ["synonyms"], idx_name)
-                if context["total"] != 1:
-                    print ("IGNORE "+gff.attrs["Name"]+" "+gff.attrs["biotype"])
-                    continue
-
-                gdata = context["data"][0]
-                if "entrezGene_id" in gff.attrs and "entrez" in gdata["dbxrefs"]:
-                    if gff.attrs["entrezGene_id"] != gdata["dbxrefs"]["entrez"]:
-                        logger.debug("Entrez ID not matching "+gff.attrs["Name"] + " " +
-                                     gff.attrs["biotype"] + " Entrez:" +
-                                     gff.attrs["entrezGene_id"] + " != " +
-                                     gdata["dbxrefs"]["entrez"])
+        if options.get('preloadGenes'):
+            lookup = self._preload_lookup(idx_name)
+        else:
+            lookup = partial(self._msearch_lookup, idx_name)
+
+        with self.indexing(idx_name, 'gene'), self.bulk_buffer(idx_name, 'gene') as buf:
+            for gffs in self._gff_batches(f):
+                genes = lookup([gff.attrs["Name"] for gff in gffs])
+                for gff in gffs:
+                    gdata = genes.get(gff.attrs["Name"])
+                    if gdata is None:
+                        print ("IGNORE "+gff.attrs["Name"]+" "+gff.attrs["biotype"])
                         continue
 
-                doc_data = {"update": {"_id": gdata["idx_id"], "_type": "gene",
-                                       "_index": idx_name, "_retry_on_conflict": 3}}
-                json_data += json.dumps(doc_data) + '\n'
-                doc_data = {"doc": {"featureloc":
-                                    {"start": gff.start,
-                                     "end": gff.end,
-                                     "seqid": gff.seqid,
-                                     "build": build
-                                     },
-                                    "biotype": gff.attrs["biotype"]
-                                    }
-                            }
-                json_data += json.dumps(doc_data) + '\n'
-                line_num += 1
-                auto_num += 1
-                if(line_num > chunk):
-                    line_num = 0
-                    print('.', end="", flush=True)
-                    self.bulk_load(idx_name, 'gene', json_data)
-                    json_data = ''
-        finally:
-            self.bulk_load(idx_name, 'gene', json_data)
-
-    def _call_elasticsearch(self, name, fields, indexName):
-        ''' Call elasticsearch '''
-        elastic = Search.field_search_query(name, fields=fields, search_from=0,
-                                            size=20, idx=indexName)
-        json_response = elastic.get_json_response()
-        context = {}
-        content = []
-        for hit in json_response['hits']['hits']:
-            hit['_source']['idx_type'] = hit['_type']
-            hit['_source']['idx_id'] = hit['_id']
-            if 'highlight' in hit:
-                hit['_source']['highlight'] = hit['highlight']
-            content.append(hit['_source'])
-
-        context["data"] = content
-        context["total"] = json_response['hits']['total']
-        return context
+                    if "entrezGene_id" in gff.attrs and "entrez" in gdata["dbxrefs"]:
+                        if gff.attrs["entrezGene_id"] != gdata["dbxrefs"]["entrez"]:
+                            logger.debug("Entrez ID not matching "+gff.attrs["Name"] + " " +
+                                         gff.attrs["biotype"] + " Entrez:" +
+                                         gff.attrs["entrezGene_id"] + " != " +
+                                         gdata["dbxrefs"]["entrez"])
+                            continue
+
+                    action = {"update": {"_id": gdata["idx_id"], "_type": "gene",
+                                         "_index": idx_name, "_retry_on_conflict": 3}}
+                    doc_data = {"doc": {"featureloc":
+                                        {"start": gff.start,
+                                         "end": gff.end,
+                                         "seqid": gff.seqid,
+                                         "build": build
+                                         },
+                                        "biotype": gff.attrs["biotype"]
+                                        }
+                                }
+                    buf.add(action, doc_data)
+
+    def _gff_batches(self, f):
+        ''' Yield lists of up to LOOKUP_BATCH GFF lines. '''
+        gffs = []
+        for line in f:
+            line = line.decode("utf-8").rstrip()
+            if(line.startswith("##")):
+                continue
+            gffs.append(GFF(line))
+            if len(gffs) >= GeneManager.LOOKUP_BATCH:
+                yield gffs
+                gffs = []
+        if len(gffs) > 0:
+            yield gffs
+
+    def _msearch_lookup(self, idx_name, names):
+        ''' Look up gene names by symbol, then synonym, in multi search requests
+        and return a dictionary of the names matching a single gene. '''
+        genes = {}
+        for fields in (["gene_symbol"], ["synonyms"]):
+            names = [name for name in names if name not in genes]
+            searches = [Search.field_search_query(name, fields=fields, search_from=0, size=20, idx=idx_name)
+                        for name in names]
+            for name, json_response in zip(names, MultiSearch(searches).get_json_response()):
+                if 'error' in json_response:
+                    logger.warn("WARNING: lookup of "+name+" failed: "+str(json_response['error']))
+                elif json_response['hits']['total'] == 1:
+                    hit = json_response['hits']['hits'][0]
+                    genes[name] = dict(hit['_source'], idx_type=hit['_type'], idx_id=hit['_id'])
+        return genes
+
+    def _preload_lookup(self, idx_name):
+        ''' Scroll the gene index once into symbol and synonym dictionaries and
+        return a function that looks up gene names in them. '''
+        symbols = {}
+        synonyms = {}
+        query = ElasticQuery(Query.match_all(), sources=["gene_symbol", "synonyms", "dbxrefs"])
+        # hits per shard for each scroll page (the default is 10)
+        query.query["size"] = 1000
+        for resp_json in ScanAndScroll.iter_pages(idx_name, idx_type='gene', query=query):
+            for hit in resp_json['hits']['hits']:
+                gdata = dict(hit['_source'], idx_type=hit['_type'], idx_id=hit['_id'])
+                gdata.setdefault("dbxrefs", {})
+                # the symbol and synonym fields use a case insensitive keyword analyzer
+                symbols.setdefault(gdata.get("gene_symbol", '').lower(), {})[hit['_id']] = gdata
+                for syn in gdata.get("synonyms") or []:
+                    synonyms.setdefault(syn.lower(), {})[hit['_id']] = gdata
+        logger.info("Preloaded "+str(len(symbols))+" gene symbols and "+str(len(synonyms))+" synonyms")
+
+        def lookup(names):
+            genes = {}
+            for name in names:
+                for names_dict in (symbols, synonyms):
+                    matches = names_dict.get(name.lower(), {})
+                    if len(matches) == 1:
+                        genes[name] = list(matches.values())[0]
+                        break
+            return genes
+        return lookup
 
     def _create_mapping(self, **options):
         ''' Create the mapping for gene names indexing '''
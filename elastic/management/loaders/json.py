@@ -1,6 +1,10 @@
 ''' Loader for JSON data. '''
 import json
 import logging
+import re
+from functools import partial
+from itertools import chain
+from elastic.stream import JsonStream
 from elastic.management.loaders.loader import JSONLoader
 from elastic.management.loaders.mapping import MappingProperties
 
@@ -14,23 +18,40 @@ class JsonManager(JSONLoader):
        "mapping": {"properties": {...}},
        "docs": [...]
     }
+    The docs are parsed one at a time as the file is read, so memory use does
+    not depend on the size of the file and the mapping has to come before the
+    docs. Files ending .ndjson or .jsonl (or with
+    .gz) hold a document per line and no mapping.
     '''
 
+    READ_SIZE = 1048576
+
     def load_json(self, **options):
         ''' Create index mapping and load data '''
         idx_name = self.get_index_name(**options)
         idx_type = self.get_index_type('marker', **options)
 
-        with open(options['indexJson']) as data_file:
-            json_data = json.load(data_file)
-
-        if len(json_data["docs"]) < 1:
-            logger.debug("No documents to load!")
-            return
-
-        if 'mapping' in json_data:
-            self._create_json_mapping(idx_type, json_data["mapping"], **options)
-        self.load(json_data["docs"], idx_name, idx_type)
+        file_name = re.sub(r'\.gz$', '', options['indexJson'])
+        is_ndjson = file_name.endswith('.ndjson') or file_name.endswith('.jsonl')
+        with self.open_file_to_load('indexJson', **options) as data_file:
+            if is_ndjson:
+                docs = (json.loads(line.decode("utf-8")) for line in data_file if line.strip() != b'')
+            else:
+                stream = JsonStream(iter(partial(data_file.read, JsonManager.READ_SIZE), b''), path=('docs',))
+                docs = iter(stream)
+
+            # the mapping has been read once the first doc has
+            first_doc = next(docs, None)
+            if first_doc is None:
+                logger.debug("No documents to load!")
+                return
+            mapping = None if is_ndjson else stream.meta.get('mapping')
+            if mapping is not None:
+                self._create_json_mapping(idx_type, mapping, **options)
+            self.load(chain([first_doc], docs), idx_name, idx_type)
+
+            if mapping is None and not is_ndjson and 'mapping' in stream.meta:
+                logger.warn("WARNING: mapping in "+options['indexJson']+" not used as it follows the docs")
 
     def _create_json_mapping(self, idx_type, mapping, **options):
         ''' Create the mapping for indexing '''
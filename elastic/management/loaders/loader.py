@@ -1,13 +1,21 @@
 ''' Parent loaders to handle mapping and bulk loading. '''
 import gzip
 import json
-import requests
 import re
+import multiprocessing
+from collections import deque
+from functools import partial
+from itertools import islice
+from contextlib import contextmanager
 from elastic.search import Search, ElasticSettings, Bulk
+from elastic.transport import Transport
+from elastic.cache import SearchCache
+from elastic.bulk import BulkIndexer, BulkBuffer
 import logging
 from elastic.management.loaders.mapping import MappingProperties
 from elastic.management.loaders.analysis import Analyzer
 from elastic.management.loaders.exceptions import LoaderError
+from elastic.management.loaders.checkpoint import Checkpoint
 
 # Get an instance of a logger
 logger = logging.getLogger(__name__)
@@ -20,6 +28,42 @@ class Loader:
     KEYWORD_ANALYZER = Analyzer("full_name", tokenizer="keyword",
                                 token_filters=["standard", "lowercase"]).analyzer
 
+    def __init__(self, **options):
+        ''' Set up the loader from the command options.
+        @type  bulkThreads: integer
+        @keyword bulkThreads: Number of threads sending bulk requests.
+        @type  bulkQueue: integer
+        @keyword bulkQueue: Number of bulk chunks queued for the sender threads.
+        @type  bulkBytes: integer
+        @keyword bulkBytes: Bulk request size that triggers a request.
+        @type  bulkDocs: integer
+        @keyword bulkDocs: Number of documents that triggers a bulk request.
+        @type  processes: integer
+        @keyword processes: Number of processes used to parse delimited files.
+        @type  fastIngest: bool
+        @keyword fastIngest: Turn off refreshes and replicas while loading (see L{start_ingest}).
+        @type  maxSegments: integer
+        @keyword maxSegments: Force merge to this number of segments after a fast ingest.
+        @type  resume: bool
+        @keyword resume: Resume a delimited file load from its checkpoint.
+        @type  checkpoint: string
+        @keyword checkpoint: Checkpoint file (default: [index]_[type].checkpoint with resume).
+        '''
+        self.bulk_threads = int(options.get('bulkThreads') or BulkIndexer.THREADS)
+        self.bulk_queue = int(options.get('bulkQueue') or BulkIndexer.QUEUE_SIZE)
+        self.bulk_bytes = int(options.get('bulkBytes') or BulkBuffer.MAX_BYTES)
+        self.bulk_docs = int(options.get('bulkDocs') or BulkBuffer.MAX_DOCS)
+        self.processes = int(options.get('processes') or 1)
+        self.fast_ingest = bool(options.get('fastIngest'))
+        self.max_segments = options.get('maxSegments')
+        self.resume = bool(options.get('resume'))
+        self.checkpoint_file = options.get('checkpoint')
+        self.load_position = (0, 0)
+        self.bulk_stats = None
+        self._indexers = {}
+        self._ingest_settings = {}
+        self._column_plans = {}
+
     def mapping(self, mapping, idx_type, meta=None, analyzer=None, **options):
         ''' Put the mapping (L{MappingProperties}) to the Elastic server. '''
         if not isinstance(mapping, MappingProperties):
@@ -28,7 +72,8 @@ class Loader:
         idx_name = self.get_index_name(**options)
         number_of_shards = self.get_number_of_shards(**options)
         url = ElasticSettings.url() + '/' + idx_name
-        resp = requests.get(url)
+        transport = Transport.get_transport()
+        resp = transport.get(url)
         if resp.status_code == 200:
             logger.warn('WARNING: '+idx_name + ' index already exists!')
         else:
@@ -37,7 +82,10 @@ class Loader:
             if analyzer is not None:
                 idx_settings['settings'].update(analyzer)
 
-            resp = requests.put(url, data=json.dumps(idx_settings))
+            resp = transport.put(url, data=json.dumps(idx_settings))
+
+        if self.fast_ingest:
+            self.start_ingest(idx_name)
 
         mapping_json = mapping.mapping_properties
         if meta is not None:
@@ -45,17 +93,100 @@ class Loader:
 
         # add mapping to index
         url += '/_mapping/' + idx_type
-        resp = requests.put(url, data=json.dumps(mapping_json))
-        self.mapping_json = mapping_json
+        resp = transport.put(url, data=json.dumps(mapping_json))
+        # keep the mappings of the other types put by this loader
+        self.mapping_json = dict(getattr(self, 'mapping_json', None) or {}, **mapping_json)
+        self._column_plans = {}
+        SearchCache.invalidate(idx_name)
 
         if(resp.status_code != 200):
             logger.warn('WARNING: '+idx_name+' mapping status: '+str(resp.status_code)+' '+str(resp.content))
             return False
         return True
 
-    def bulk_load(self, idx_name, idx_type, json_data):
-        ''' Bulk load documents. '''
-        Bulk.load(idx_name, idx_type, json_data)
+    def start_ingest(self, idx_name):
+        ''' Tune an index for bulk loading by turning off refreshes and replicas.
+        The original settings are restored by L{finish_ingest}. If idx_name
+        is an alias the indices it points at are tuned. '''
+        transport = Transport.get_transport()
+        resp = transport.get(ElasticSettings.url() + '/' + idx_name + '/_settings')
+        if resp.status_code != 200:
+            logger.warn('WARNING: '+idx_name+' settings status: '+str(resp.status_code))
+            return
+        # the settings are keyed by the concrete index names
+        for name, idx_json in resp.json().items():
+            if name in self._ingest_settings:
+                continue
+            idx_settings = idx_json['settings']['index']
+            self._ingest_settings[name] = {
+                "refresh_interval": idx_settings.get('refresh_interval', '1s'),
+                "number_of_replicas": idx_settings.get('number_of_replicas', 1)
+            }
+            transport.put(ElasticSettings.url() + '/' + name + '/_settings',
+                          data=json.dumps({"index": {"refresh_interval": "-1", "number_of_replicas": 0}}))
+            logger.info(name+' tuned for bulk loading')
+
+    def finish_ingest(self):
+        ''' Restore the settings of the indices tuned by L{start_ingest}, refresh
+        them and optionally force merge them to maxSegments segments. '''
+        transport = Transport.get_transport()
+        for idx_name, idx_settings in list(self._ingest_settings.items()):
+            url = ElasticSettings.url() + '/' + idx_name
+            resp = transport.put(url + '/_settings', data=json.dumps({"index": idx_settings}))
+            if resp.status_code != 200:
+                logger.error('ERROR: '+idx_name+' settings not restored: '+str(resp.content))
+                continue
+            del self._ingest_settings[idx_name]
+            Search.index_refresh(idx_name)
+            if self.max_segments is not None:
+                merge = '/_optimize' if ElasticSettings.version()['major'] < 5 else '/_forcemerge'
+                transport.post(url + merge + '?max_num_segments=' + str(self.max_segments), timeout=None)
+            logger.info(idx_name+' settings restored')
+
+    def bulk_load(self, idx_name, idx_type, json_data, callback=None):
+        ''' Bulk load documents. Within L{indexing} the documents are queued
+        for the sender threads, otherwise they are loaded directly. The
+        optional callback is called with the number of documents accepted
+        and failed. '''
+        indexer = self._indexers.get((idx_name, idx_type))
+        if indexer is not None:
+            indexer.add(json_data, callback=callback)
+        else:
+            (accepted, failed) = Bulk.load_chunk(idx_name, idx_type, json_data)
+            if callback is not None:
+                callback(accepted, failed)
+
+    def bulk_buffer(self, idx_name, idx_type, max_docs=None, checkpoint=None):
+        ''' Return a L{BulkBuffer} that calls L{bulk_load} when it reaches the
+        bulkBytes size or bulkDocs (or max_docs) number of documents. If a
+        L{Checkpoint} is given it records load_position once a chunk is loaded. '''
+        def flush(json_data):
+            print('.', end="", flush=True)
+            callback = None
+            if checkpoint is not None:
+                chunk = checkpoint.sent(*self.load_position)
+                callback = (lambda accepted, failed: checkpoint.acknowledged(chunk, ok=(failed == 0)))
+            self.bulk_load(idx_name, idx_type, json_data, callback=callback)
+        return BulkBuffer(flush, max_bytes=self.bulk_bytes,
+                          max_docs=(max_docs if max_docs is not None else self.bulk_docs))
+
+    @contextmanager
+    def indexing(self, idx_name, idx_type):
+        ''' Context in which L{bulk_load} hands the chunks for an index type to
+        a L{BulkIndexer}. On exit waits for them to be loaded and records the
+        accepted and failed document totals in bulk_stats. '''
+        key = (idx_name, idx_type)
+        if key in self._indexers:
+            yield self._indexers[key]
+            return
+        indexer = BulkIndexer(idx_name, idx_type, threads=self.bulk_threads, queue_size=self.bulk_queue)
+        self._indexers[key] = indexer
+        try:
+            yield indexer
+        finally:
+            del self._indexers[key]
+            indexer.close()
+            self.bulk_stats = indexer.stats()
 
     def get_index_name(self, **options):
         ''' Get indexName option. '''
@@ -76,17 +207,31 @@ class Loader:
         else:
             return open(options[file_name], 'rb')
 
+    def get_checkpoint(self, idx_name, idx_type):
+        ''' Return the L{Checkpoint} for a load if the checkpoint or resume option is set. '''
+        if self.checkpoint_file is None and not self.resume:
+            return None
+        file_name = self.checkpoint_file
+        if file_name is None:
+            file_name = idx_name + '_' + idx_type + '.checkpoint'
+        return Checkpoint(file_name, idx_name, idx_type)
+
+    def get_mapping_json(self, idx_name, idx_type):
+        ''' Return the mapping put by L{mapping} or else get it from the index. '''
+        if not getattr(self, 'mapping_json', None):
+            self.mapping_json = Search(idx=idx_name).get_mapping(idx_type)[idx_name]['mappings']
+        return self.mapping_json
+
     def is_str(self, column_name, idx_name, idx_type):
         ''' Looks at the mapping to determine if the type is a string. '''
-        if not self.mapping_json:
-            self.mapping_json = Search(idx=idx_name).get_mapping(idx_type)[idx_name]['mappings']
+        return self.map_type(column_name, idx_name, idx_type) == 'string'
+
+    def map_type(self, column_name, idx_name, idx_type):
+        ''' Return the mapping type of a column or None if it is not mapped. '''
         try:
-            map_type = self.mapping_json[idx_type]["properties"][column_name]["type"]
+            return self.get_mapping_json(idx_name, idx_type)[idx_type]["properties"][column_name]["type"]
         except KeyError:
-            return False
-        if map_type == 'string':
-            return True
-        return False
+            return None
 
     def get_index_type(self, default_type, **options):
         if options['indexType']:
@@ -94,69 +239,185 @@ class Loader:
         return default_type
 
 
+def _to_str(value):
+    ''' String column value. '''
+    return value
+
+
+def _to_list(value):
+    ''' String column value, a list if the values are separated by '::'. '''
+    if "::" in value:
+        return value.split('::')
+    return value
+
+
+def _to_int(value):
+    ''' Integer column value, left as a string if it is not a number. '''
+    try:
+        return int(value)
+    except ValueError:
+        return value
+
+
+def _to_float(value):
+    ''' Float column value, left as a string if it is not a number. '''
+    try:
+        return float(value)
+    except ValueError:
+        return value
+
+
+def _line_blocks(file_handle, block_lines):
+    ''' Yield lists of lines read from a file. '''
+    block = []
+    for line in file_handle:
+        block.append(line)
+        if len(block) >= block_lines:
+            yield block
+            block = []
+    if len(block) > 0:
+        yield block
+
+
+# loader used to parse lines in a worker process
+_PARSER = None
+
+
+def _init_parser(loader_cls, mapping_json, *parse_args):
+    ''' Set up the loader in a worker process. '''
+    global _PARSER
+    loader = loader_cls()
+    loader.mapping_json = mapping_json
+    _PARSER = (loader, parse_args)
+
+
+def _parse_block(lines, first_line):
+    ''' Parse a block of lines in a worker process and return the line numbers
+    and documents as JSON. '''
+    (loader, parse_args) = _PARSER
+    return [(line_num, json.dumps(doc_data))
+            for line_num, doc_data in loader.parse_lines(lines, *parse_args, first_line=first_line)]
+
+
 class DelimeterLoader(Loader):
     ''' Loader for files with delimited columns (comma, tab I{etc}). '''
 
-    def load(self, column_names, file_handle, idx_name, idx_type='tab', delim='\t',
-             is_GFF=False, is_GTF=False, chunk=5000):
-        ''' Index tab data '''
-        json_data = ''
-        line_num = 0
-        auto_num = 1
+    BLOCK_LINES = 5000
+    # load string column values separated by '::' as lists
+    SPLIT_LISTS = True
 
-        try:
-            for line in file_handle:
-                line = line.decode("utf-8")
-                if(line.startswith("#")):
-                    continue
-                parts = re.split(delim, line)
-                if len(parts) != len(column_names):
-                    logger.warn("WARNING: unexpected number of columns: ["+str(line_num+1)+'] '+line)
-                    continue
-
-                idx_id = str(auto_num)
-                json_data += '{"index": {"_id": "%s"}}\n' % idx_id
-                doc_data = self.parse_line(parts, column_names, idx_name, idx_type, is_GFF, is_GTF)
-                json_data += json.dumps(doc_data) + '\n'
-
-                line_num += 1
-                auto_num += 1
-                if(line_num > chunk):
-                    line_num = 0
-                    print('.', end="", flush=True)
-                    self.bulk_load(idx_name, idx_type, json_data)
-                    json_data = ''
-        finally:
-            self.bulk_load(idx_name, idx_type, json_data)
-            logger.info('No. documents loaded: '+str(auto_num-1))
+    def load(self, column_names, file_handle, idx_name, idx_type='tab', delim='\t',
+             is_GFF=False, is_GTF=False, chunk=None):
+        ''' Index tab data. Bulk requests are sent every chunk documents
+        (default: bulkDocs option) or bulkBytes, whichever comes first. If
+        the processes option is more than 1 the lines are parsed in blocks
+        by a pool of processes. With a checkpoint the position of the loaded
+        lines is recorded so that the load can be resumed. Returns the number of
+        documents loaded. '''
+        checkpoint = self.get_checkpoint(idx_name, idx_type)
+        (first_line, last_id) = (0, 0)
+        if checkpoint is not None and self.resume:
+            (first_line, last_id) = checkpoint.position()
+        lines = islice(file_handle, first_line, None)
+        auto_num = last_id + 1
 
-    def parse_line(self, parts, column_names, idx_name, idx_type, is_GFF, is_GTF):
-        ''' Parse the parts that make up the line. '''
-        doc_data = {}
-        for idx, p in enumerate(parts):
-            p = p.strip()
+        parse_args = (column_names, idx_name, idx_type, delim, is_GFF, is_GTF)
+        # start the parsing processes before the bulk sender threads
+        pool = self._parser_pool(*parse_args) if self.processes > 1 else None
 
-            if (is_GFF or is_GTF) and idx == len(parts)-1:
-                if is_GTF:
-                    attrs = self._getAttributes(p, key_value_delim=' ')
+        with self.indexing(idx_name, idx_type), \
+                self.bulk_buffer(idx_name, idx_type, max_docs=chunk, checkpoint=checkpoint) as buf:
+            try:
+                if pool is not None:
+                    docs = self._parse_parallel(pool, lines, first_line)
                 else:
-                    attrs = self._getAttributes(p)
-                doc_data[column_names[idx]] = attrs
+                    docs = self.parse_lines(lines, *parse_args, first_line=first_line)
+                for line_num, doc_data in docs:
+                    # ids follow the line order so that reloading a chunk is idempotent
+                    self.load_position = (line_num, auto_num)
+                    buf.add({"index": {"_id": str(auto_num)}}, doc_data)
+                    auto_num += 1
+            finally:
+                if pool is not None:
+                    pool.terminate()
+                    pool.join()
+                logger.info('No. documents loaded: '+str(auto_num-1-last_id))
+        if checkpoint is not None:
+            checkpoint.remove()
+        return auto_num-1-last_id
+
+    def parse_lines(self, lines, column_names, idx_name, idx_type, delim, is_GFF, is_GTF, first_line=0):
+        ''' Parse lines and yield the line number (counting from first_line) and
+        document for each line loaded. '''
+        plan = self.column_plan(column_names, idx_name, idx_type, is_GFF, is_GTF)
+        split = re.compile(delim).split
+        ncolumns = len(plan)
+        for line_num, line in enumerate(lines, start=first_line+1):
+            line = line.decode("utf-8")
+            if(line.startswith("#")):
                 continue
+            parts = split(line)
+            if len(parts) != ncolumns:
+                logger.warn("WARNING: unexpected number of columns: ["+str(line_num)+'] '+line)
+                continue
+            yield (line_num, {name: convert(p.strip()) for (name, convert), p in zip(plan, parts)})
 
-            if self.is_str(column_names[idx], idx_name, idx_type):
-                if "::" in p:
-                    p = p.split('::')
-                    doc_data[column_names[idx]] = p
-                else:
-                    doc_data[column_names[idx]] = p
-            elif p.isdigit():
-                doc_data[column_names[idx]] = int(p)
-            elif self._isfloat(p):
-                doc_data[column_names[idx]] = float(p)
+    def column_plan(self, column_names, idx_name, idx_type, is_GFF=False, is_GTF=False):
+        ''' Return a list of (column name, converter) pairs used to build the
+        document from the parts of a line, from the mapping of the columns. The
+        plan is compiled once for each index type and header. '''
+        key = (idx_name, idx_type, tuple(column_names), is_GFF, is_GTF)
+        if key in self._column_plans:
+            return self._column_plans[key]
+        plan = []
+        for idx, name in enumerate(column_names):
+            if (is_GFF or is_GTF) and idx == len(column_names)-1:
+                key_value_delim = ' ' if is_GTF else '='
+                plan.append((name, partial(self._getAttributes, key_value_delim=key_value_delim)))
             else:
-                doc_data[column_names[idx]] = p
-        return doc_data
+                plan.append((name, self._converter(name, self.map_type(name, idx_name, idx_type))))
+        self._column_plans[key] = plan
+        return plan
+
+    def _converter(self, column_name, map_type):
+        ''' Return the function that converts a column value for a mapping type.
+        Date columns are left as strings, as JSON has no date type and Elastic
+        parses them with the format given in the mapping. Columns that are not
+        in the mapping are also left as strings (rather than guessing a number
+        type from each value) so Elastic maps them dynamically as strings; add
+        number columns to the mapping to load them as numbers. '''
+        if map_type == 'string':
+            return _to_list if self.SPLIT_LISTS else _to_str
+        if map_type in ('integer', 'long', 'short', 'byte'):
+            return _to_int
+        if map_type in ('float', 'double'):
+            return _to_float
+        return _to_str
+
+    def _parser_pool(self, column_names, idx_name, idx_type, delim, is_GFF, is_GTF):
+        ''' Start a pool of processes that parse lines with a copy of this loader. '''
+        mapping_json = self.get_mapping_json(idx_name, idx_type)
+        return multiprocessing.Pool(self.processes, initializer=_init_parser,
+                                    initargs=(self.__class__, mapping_json, column_names, idx_name,
+                                              idx_type, delim, is_GFF, is_GTF))
+
+    def _parse_parallel(self, pool, lines, first_line=0):
+        ''' Parse blocks of lines in the pool of processes and yield the line
+        numbers and documents as JSON, in the order of the lines. '''
+        # keep a few blocks per process queued so memory use is bounded
+        pending = deque()
+        for block in _line_blocks(lines, DelimeterLoader.BLOCK_LINES):
+            pending.append(pool.apply_async(_parse_block, (block, first_line)))
+            first_line += len(block)
+            if len(pending) >= 2 * self.processes:
+                yield from pending.popleft().get()
+        while len(pending) > 0:
+            yield from pending.popleft().get()
+
+    def parse_line(self, parts, column_names, idx_name, idx_type, is_GFF, is_GTF):
+        ''' Parse the parts that make up the line. '''
+        plan = self.column_plan(column_names, idx_name, idx_type, is_GFF, is_GTF)
+        return {name: convert(p.strip()) for (name, convert), p in zip(plan, parts)}
 
     def _getAttributes(self, attrs, key_value_delim='='):
         ''' Parse the attributes column '''
@@ -185,9 +446,7 @@ class JSONLoader(Loader):
 
     def load(self, raw_json_data, idx_name, idx_type='json'):
         ''' Index raw json data '''
-        json_data = ''
-        line_num = 0
-        try:
+        with self.indexing(idx_name, idx_type), self.bulk_buffer(idx_name, idx_type) as buf:
             for row in raw_json_data:
                 row_obj = {"index": {}}
                 if '_id' in row:
@@ -196,14 +455,4 @@ class JSONLoader(Loader):
                 if '_parent' in row:
                     row_obj['index'].update({"parent": row['_parent']})
                     del row['_parent']
-                json_data += json.dumps(row_obj) + '\n'
-                json_data += json.dumps(row) + '\n'
-                line_num += 1
-
-                if(line_num > 5000):
-                    line_num = 0
-                    print('.', end="", flush=True)
-                    self.bulk_load(idx_name, idx_type, json_data)
-                    json_data = ''
-        finally:
-            self.bulk_load(idx_name, idx_type, json_data)
+                buf.add(row_obj, row)
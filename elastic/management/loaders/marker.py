@@ -11,7 +11,7 @@ class MarkerManager(DelimeterLoader):
         idx_type = self.get_index_type('marker', **options)
         map_props = self._create_snp_mapping(idx_type, **options)
         f = self.open_file_to_load('indexSNP', **options)
-        self.load(map_props.get_column_names()[:-1], f, idx_name, idx_type, chunk=20000)
+        self.load(map_props.get_column_names()[:-1], f, idx_name, idx_type)
 
     def _create_snp_mapping(self, idx_type, **options):
         ''' Create the mapping for snp index '''
@@ -34,13 +34,15 @@ class MarkerManager(DelimeterLoader):
 
 class RsMerge(DelimeterLoader):
 
+    SPLIT_LISTS = False
+
     def create_load_snp_merge_index(self, **options):
         ''' Index rs number merge dbSNP data '''
         idx_name = self.get_index_name(**options)
         idx_type = self.get_index_type('rs_merge', **options)
         map_props = self._create_rs_merge_mapping(idx_type, **options)
         f = self.open_file_to_load('indexSNPMerge', **options)
-        self.load(map_props.get_column_names(), f, idx_name, idx_type, chunk=10000)
+        self.load(map_props.get_column_names(), f, idx_name, idx_type)
 
     def _create_rs_merge_mapping(self, idx_type, **options):
         ''' Create the mapping for rs index '''
@@ -57,17 +59,8 @@ class RsMerge(DelimeterLoader):
         self.mapping(props, idx_type, **options)
         return props
 
-    def parse_line(self, parts, column_names, idx_name, idx_type, is_GFF, is_GTF):
-        ''' Overrides Delimeter.parse_line() - to prefix rs numbers with "rs". '''
-        doc_data = {}
-        for idx, p in enumerate(parts):
-            p = p.strip()
-            if column_names[idx] in ["rscurrent", "rslow", "rshigh"]:
-                p = "rs"+p
-            if self.is_str(column_names[idx], idx_name, idx_type):
-                doc_data[column_names[idx]] = p
-            elif p.isdigit():
-                doc_data[column_names[idx]] = int(p)
-            else:
-                doc_data[column_names[idx]] = p
-        return doc_data
+    def _converter(self, column_name, map_type):
+        ''' Overrides Loader._converter() - to prefix rs numbers with "rs". '''
+        if column_name in ["rscurrent", "rslow", "rshigh"]:
+            return lambda value: "rs"+value
+        return super()._converter(column_name, map_type)
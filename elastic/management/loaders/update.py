@@ -1,9 +1,11 @@
 ''' Update manager to update indexes '''
-from elastic.search import Search, ScanAndScroll, ElasticQuery
+from elastic.search import Search, ScanAndScroll, ElasticQuery, Update
 from elastic.management.loaders.loader import Loader
-import sys
+from elastic.bulk import BulkBuffer, BulkIndexer
 import json
 import logging
+import queue
+import threading
 from elastic.query import Query
 import random
 import timeit
@@ -11,100 +13,168 @@ import timeit
 # Get an instance of a logger
 logger = logging.getLogger(__name__)
 
-JSON_LINES = ""
-IDX_NAME = ""
-IDX_TYPE = ""
-
-
-def fetch_update(resp_json):
-    '''
-    Docs are fetched in chunks of 500 (chunk size) and for each doc, update api is called
-    with the newly added contents from JSON_LINES
-    '''
-    logger.debug('fetch update called')
-    global JSON_LINES
-    global IDX_NAME
-    global IDX_TYPE
-
-    global START_TIME
-    global END_TIME
-    global TIME_TAKEN
-
-    line_num = 0
-    auto_num = 1
-    json_data = ''
-    chunk = 500
-    try:
-        for doc in resp_json['hits']['hits']:
-            doc_data = {"update": {"_id": doc["_id"], "_type": IDX_TYPE, "_index": IDX_NAME, "_retry_on_conflict": 3}}
-            json_data += json.dumps(doc_data) + '\n'
-            json_data += json.dumps(JSON_LINES) + '\n'
-
-            line_num += 1
-            auto_num += 1
-
-            if(line_num > chunk):
-                line_num = 0
-                print('.', end="", flush=True)
-                Loader().bulk_load(IDX_NAME, IDX_TYPE, json_data)
-                json_data = ''
-
-    finally:
-        Loader().bulk_load(IDX_NAME, IDX_TYPE, json_data)
-        pass
-
-    END_TIME = timeit.default_timer()
-    TIME_TAKEN = END_TIME - START_TIME
-    logger.debug('Total time taken ' + str(TIME_TAKEN))
+
+class UpdateRun(object):
+    ''' Update the documents of an index, I{e.g.} with a partial document. Pages of hits
+    are queued and a worker thread builds the update bulk requests that are sent
+    by a L{BulkIndexer}, so scrolling carries on while the updates are sent. Runs
+    have no shared state so several can update different indices at the same time. '''
+
+    WORKERS = 2
+    QUEUE_SIZE = 4
+    # tells the worker thread to stop
+    _STOP = object()
+
+    def __init__(self, idx_name, idx_type, update_body, workers=WORKERS, queue_size=QUEUE_SIZE,
+                 max_bytes=BulkBuffer.MAX_BYTES, max_docs=BulkBuffer.MAX_DOCS):
+        ''' Start the worker and sender threads.
+        @type  idx_name: string
+        @param idx_name: Index to update.
+        @type  idx_type: string
+        @param idx_type: Index type to update.
+        @type  update_body: dict
+        @param update_body: Body of the update action, I{e.g.} a partial document ({"doc": {...}}).
+        @type  workers: integer
+        @keyword workers: Number of threads sending the updates.
+        @type  queue_size: integer
+        @keyword queue_size: Number of pages (and bulk requests) queued before L{add_hits} blocks.
+        '''
+        self.idx_name = idx_name
+        self.idx_type = idx_type
+        self.max_bytes = max_bytes
+        self.max_docs = max_docs
+        # the same update is sent for every doc so serialise it once
+        self.json_lines = json.dumps(update_body)
+        self.error = None
+        self._queue = queue.Queue(maxsize=max(queue_size, 1))
+        self._start_time = timeit.default_timer()
+        self._end_time = None
+        self._indexer = BulkIndexer(idx_name, idx_type, threads=workers, queue_size=queue_size)
+        self._worker = threading.Thread(target=self._update, name='elastic-update-'+idx_name)
+        self._worker.daemon = True
+        self._worker.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def add_hits(self, hits):
+        ''' Queue a page of hits to update, blocking while the queue is full. '''
+        if self.error is not None:
+            raise self.error
+        if self._indexer.error is not None:
+            raise self._indexer.error
+        self._queue.put(hits)
+
+    def add_page(self, resp_json):
+        ''' Queue the hits of a search response. '''
+        self.add_hits(resp_json['hits']['hits'])
+
+    def close(self):
+        ''' Wait for the queued updates to be sent and stop the worker and sender threads. '''
+        if self._worker is not None:
+            self._queue.put(UpdateRun._STOP)
+            self._worker.join()
+            self._worker = None
+            self._indexer.close()
+            self._end_time = timeit.default_timer()
+            logger.info("Updated " + self.idx_name + "/" + self.idx_type + ": " + str(self.stats()))
+        if self.error is not None:
+            raise self.error
+
+    def stats(self):
+        ''' Return the number of documents updated and failed and the throughput. '''
+        end_time = self._end_time if self._end_time is not None else timeit.default_timer()
+        seconds = end_time - self._start_time
+        stats = self._indexer.stats()
+        docs = stats["accepted"] + stats["failed"]
+        return {"docs": docs, "accepted": stats["accepted"], "failed": stats["failed"],
+                "seconds": round(seconds, 2), "docs_per_sec": round(docs / seconds if seconds > 0 else 0)}
+
+    def _update(self):
+        buf = BulkBuffer(self._indexer.add, max_bytes=self.max_bytes, max_docs=self.max_docs)
+        while True:
+            hits = self._queue.get()
+            if hits is UpdateRun._STOP:
+                break
+            if self.error is not None:
+                # drain the queue so that add_hits does not block
+                continue
+            try:
+                for hit in hits:
+                    buf.add({"update": {"_id": hit["_id"], "_type": self.idx_type, "_index": self.idx_name,
+                                        "_retry_on_conflict": 3}}, self.json_lines)
+            except Exception as e:
+                logger.error("ERROR: update of " + self.idx_name + " failed: " + str(e))
+                self.error = e
+        if self.error is None:
+            try:
+                buf.flush()
+            except Exception as e:
+                logger.error("ERROR: update of " + self.idx_name + " failed: " + str(e))
+                self.error = e
 
 
 class UpdateManager(Loader):
 
     def update_idx(self, **options):
-
         '''
-        The data to be added to the existing doc is taken from json_data option and saved in global JSON_LINES
-        scan_and_scroll (pulls batches of results from Elasticsearch until there are no more results left),
-        and the actual update is done by fetch_update method
-        Use random updates option for testing only
+        The update (I{e.g.} {"doc": {...}}) applied to the existing docs is taken from the json_data option.
+        The docs are scanned and scrolled (pulling batches of results from Elasticsearch
+        until there are no more results left) and the updates are sent by an L{UpdateRun}.
+        With the update_by_query option the fields are set by the cluster (see L{Update.update_by_query})
+        unless it does not support it. The query option restricts the documents updated.
+        Use random updates option for testing only.
+        Returns the L{UpdateRun} stats.
         '''
-
-        global JSON_LINES
-        global IDX_NAME
-        global IDX_TYPE
-        # idx_name = 'region_perms_test_idx'
-        IDX_NAME = options['indexName']
-        IDX_TYPE = options['indexType']
-        logger.debug("Index name " + IDX_NAME)
-        logger.debug("Index type " + IDX_TYPE)
+        idx_name = options['indexName']
+        idx_type = options['indexType']
+        logger.debug("Index name " + idx_name)
+        logger.debug("Index type " + idx_type)
 
         f = self.open_file_to_load('json_data', **options)
-
         lines = ''
-        try:
-            for line in f:
-                lines += line.decode("utf-8").rstrip()
-
-            JSON_LINES = json.loads(lines)
-
-            if options['random_update']:
+        for line in f:
+            lines += line.decode("utf-8").rstrip()
+        update_body = json.loads(lines)
+
+        query = self.get_query(**options)
+        slices = int(options.get('slices') or 1)
+
+        # the json data is the body of an update action, only partial documents can be set by query
+        if options.get('update_by_query') and not options.get('random_update') and 'doc' in update_body:
+            updated = Update.update_by_query(idx_name, update_body['doc'], idx_type=idx_type, query=query,
+                                             slices=slices)
+            if updated is not None:
+                logger.info('Updated ' + str(updated) + ' documents on the cluster')
+                return {"docs": updated, "accepted": updated, "failed": 0}
+            logger.info('Update by query not supported, updating from the client')
+
+        with UpdateRun(idx_name, idx_type, update_body, workers=self.bulk_threads, queue_size=self.bulk_queue,
+                       max_bytes=self.bulk_bytes, max_docs=self.bulk_docs) as run:
+            if options.get('random_update'):
                 logger.debug('Random updates')
-                self.do_random_idx_updates(JSON_LINES, **options)
+                self.do_random_idx_updates(run, **options)
             else:
                 logger.debug('Complete updates')
-                ScanAndScroll.scan_and_scroll(IDX_NAME, call_fun=fetch_update, idx_type=IDX_TYPE)
-        except:
-            logger.debug("Unexpected error:", sys.exc_info()[0])
-
-    def do_random_idx_updates(self, JSON_LINES, **options):
+                ScanAndScroll.scan_and_scroll(idx_name, call_fun=run.add_page, idx_type=idx_type,
+                                              query=query, slices=slices)
+        return run.stats()
+
+    def get_query(self, **options):
+        ''' Return the L{ElasticQuery} for the query option (a query in JSON) or
+        None to update all documents. '''
+        if options.get('query'):
+            return ElasticQuery(Query(json.loads(options['query'])))
+        return None
+
+    def do_random_idx_updates(self, run, **options):
         '''
         Random ids are generated, docs are searched for those ids, and if docs present they are updated...ONLY for TEST
         '''
         logger.debug("Random update called")
-        global START_TIME
-
-        START_TIME = timeit.default_timer()
-        print("START TIME" + str(START_TIME))
 
         min_int = 1
         max_int = 111373853
@@ -121,5 +191,4 @@ class UpdateManager(Loader):
         elastic = Search(query, size=1000000, idx=options['indexName'], idx_type=options['indexType'])
         resp_count = elastic.get_count()
         logger.debug('Response count ' + str(resp_count['count']))
-        json_resp = elastic.get_json_response()
-        fetch_update(json_resp)
+        run.add_hits(elastic.iter_hits())
@@ -0,0 +1,167 @@
+''' Blue/green reindexing through index aliases.
+
+An index is rebuilt into a new versioned index (I{e.g.} genes_v20261018)
+while searches carry on using the alias (I{e.g.} genes) which points at the
+current version. Once the new index is loaded and its document count has
+been checked the alias is moved to it in a single atomic request, so users
+never see a half-loaded index. Old versions can then be deleted, I{e.g.}::
+
+    idx = Reindex.generation_name('genes')
+    ... load idx ...
+    Reindex.publish('genes', idx, min_docs=1000, keep=1)
+
+As the alias has the name of the old index, the index names in the ELASTIC
+settings do not change. Before Elasticsearch 6 an index cannot be replaced
+by an alias in one request, so the first swap of an existing index deletes
+it just after a temporary alias (I{e.g.} genes_swap) has been added to the
+new version and the name is unavailable until the alias is added.
+'''
+from elastic.elastic_settings import ElasticSettings
+from elastic.transport import Transport
+from elastic.search import Search
+from elastic.cache import SearchCache
+from elastic.management.loaders.exceptions import LoaderError
+import json
+import logging
+import re
+import time
+
+# Get an instance of a logger
+logger = logging.getLogger(__name__)
+
+
+class Reindex():
+    ''' Build versioned indices and swap the alias used to search them. '''
+
+    @classmethod
+    def generation_name(cls, alias):
+        ''' Return an unused versioned index name for an alias. '''
+        idx = alias + '_v' + time.strftime('%Y%m%d')
+        existing = Reindex.generations(alias)
+        name = idx
+        n = 2
+        while name in existing:
+            name = idx + '_' + str(n)
+            n += 1
+        return name
+
+    @classmethod
+    def generation_key(cls, alias, idx):
+        ''' Return the (date, number) of a versioned index name, used to order
+        the versions, or None if it is not a version of the alias. '''
+        match = re.match(re.escape(alias) + r'_v(\d{8})(?:_(\d+))?$', idx)
+        if match is None:
+            return None
+        return (int(match.group(1)), int(match.group(2) or 1))
+
+    @classmethod
+    def generations(cls, alias):
+        ''' Return a dictionary of the versioned indices of an alias and the
+        aliases of each. '''
+        resp = Transport.get_transport().get(ElasticSettings.url() + '/_aliases')
+        if resp.status_code != 200:
+            raise LoaderError("aliases status: "+str(resp.status_code))
+        return {idx: list(idx_aliases.get('aliases', {}).keys())
+                for idx, idx_aliases in resp.json().items() if Reindex.generation_key(alias, idx) is not None}
+
+    @classmethod
+    def validate(cls, idx, min_docs=1):
+        ''' Check the new index has at least min_docs documents. '''
+        Search.index_refresh(idx)
+        count = Search(idx=idx).get_count().get('count', 0)
+        if count < min_docs:
+            raise LoaderError(idx+" has "+str(count)+" documents, expected at least "+str(min_docs))
+        logger.info(idx+" has "+str(count)+" documents")
+        return count
+
+    @classmethod
+    def swap(cls, alias, idx):
+        ''' Point the alias at the index and away from its other versions in
+        a single request. '''
+        url = ElasticSettings.url()
+        actions = [{"remove": {"index": old_idx, "alias": alias}}
+                   for old_idx, idx_aliases in Reindex.generations(alias).items()
+                   if alias in idx_aliases and old_idx != idx]
+        actions.append({"add": {"index": idx, "alias": alias}})
+
+        # an index with the alias name, from before reindexing was used
+        if Transport.get_transport().head(url + '/' + alias).status_code == 200 and \
+                len(Reindex.aliases(alias)) == 0:
+            if ElasticSettings.version()['major'] < 6:
+                Reindex._replace_index(alias, idx)
+                return
+            actions.append({"remove_index": {"index": alias}})
+
+        Reindex._update_aliases(alias, idx, actions)
+        logger.info("Alias "+alias+" now points at "+idx)
+
+    @classmethod
+    def _replace_index(cls, alias, idx):
+        ''' Replace an index by an alias with its name. The old index is only
+        deleted once a temporary alias has been added to the new index, which
+        stays available through it if a later request fails. '''
+        url = ElasticSettings.url()
+        tmp_alias = alias + '_swap'
+        Reindex._update_aliases(alias, idx, [{"add": {"index": idx, "alias": tmp_alias}}])
+
+        logger.warn("WARNING: deleting index "+alias+" so that it can be replaced by an alias")
+        resp = Transport.get_transport().delete(url + '/' + alias)
+        SearchCache.invalidate(alias)
+        if resp.status_code != 200:
+            raise LoaderError(alias+" not deleted: "+str(resp.status_code)+", "+idx+" is aliased as "+tmp_alias)
+
+        Reindex._update_aliases(alias, idx, [{"remove": {"index": idx, "alias": tmp_alias}},
+                                             {"add": {"index": idx, "alias": alias}}])
+        logger.info("Index "+alias+" replaced by an alias of "+idx)
+
+    @classmethod
+    def _update_aliases(cls, alias, idx, actions):
+        resp = Transport.get_transport().post(ElasticSettings.url() + '/_aliases',
+                                              data=json.dumps({"actions": actions}))
+        SearchCache.invalidate(alias)
+        if resp.status_code != 200:
+            raise LoaderError("alias "+alias+" not moved to "+idx+": "+str(resp.content))
+
+    @classmethod
+    def aliases(cls, alias):
+        ''' Return the indices an alias points at. '''
+        resp = Transport.get_transport().get(ElasticSettings.url() + '/_alias/' + alias)
+        if resp.status_code != 200:
+            return []
+        return list(resp.json().keys())
+
+    @classmethod
+    def delete_old(cls, alias, keep=0):
+        ''' Delete the versions of an index that the alias does not point at,
+        apart from the keep most recent. '''
+        old = sorted((idx for idx, idx_aliases in Reindex.generations(alias).items() if alias not in idx_aliases),
+                     key=lambda idx: Reindex.generation_key(alias, idx))
+        for idx in old[:max(len(old) - keep, 0)]:
+            resp = Transport.get_transport().delete(ElasticSettings.url() + '/' + idx)
+            if resp.status_code != 200:
+                logger.warn("WARNING: "+idx+" not deleted: "+str(resp.status_code))
+            else:
+                logger.info("Deleted "+idx)
+
+    @classmethod
+    def publish(cls, alias, idx, min_docs=1, keep=None):
+        ''' Validate a newly loaded index, move the alias to it and optionally
+        delete the old versions.
+        @type  alias: string
+        @param alias: Alias used to search the index.
+        @type  idx: string
+        @param idx: Newly loaded versioned index.
+        @type  min_docs: integer
+        @keyword min_docs: Minimum number of documents the new index should have.
+        @type  keep: integer
+        @keyword keep: Number of old versions to keep (default: keep all).
+        '''
+        try:
+            Reindex.validate(idx, min_docs=min_docs)
+        except LoaderError:
+            logger.error("ERROR: deleting "+idx+" which failed validation")
+            Transport.get_transport().delete(ElasticSettings.url() + '/' + idx)
+            raise
+        Reindex.swap(alias, idx)
+        if keep is not None:
+            Reindex.delete_old(alias, keep=keep)
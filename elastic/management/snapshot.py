@@ -1,5 +1,5 @@
 from elastic.elastic_settings import ElasticSettings
-import requests
+from elastic.transport import Transport
 import json
 import logging
 import os
@@ -15,7 +15,7 @@ class Snapshot():
     @classmethod
     def is_running(cls, repo=''):
         url = ElasticSettings.url() + '/_snapshot/' + repo + '/_status'
-        resp = requests.get(url)
+        resp = Transport.get_transport().get(url)
         if resp.status_code != 200:
             logger.debug(url+' :: '+resp.status_code)
         else:
@@ -30,7 +30,7 @@ class Snapshot():
     def exists(cls, repo, snapshot):
         ''' Test if the repository/snapshot exists. '''
         url = ElasticSettings.url() + '/_snapshot/' + repo + '/' + snapshot
-        resp = requests.get(url)
+        resp = Transport.get_transport().get(url)
         if resp.status_code != 200:
             return False
         else:
@@ -54,7 +54,7 @@ class Snapshot():
             repo = ''
             snapshots = ''
         url = ElasticSettings.url() + '/_snapshot/' + repo + '/' + snapshots
-        resp = requests.get(url)
+        resp = Transport.get_transport().get(url)
         if resp.status_code != 200:
             logger.error("Returned status (for "+url+"): "+str(resp.status_code))
             logger.error(resp.json()["error"])
@@ -76,7 +76,7 @@ class Snapshot():
         data = {"type": "fs",
                 "settings": {"location": location}
                 }
-        resp = requests.put(url, data=json.dumps(data))
+        resp = Transport.get_transport().put(url, data=json.dumps(data))
         if resp.status_code != 200:
             logger.error("Status ("+url+"): "+str(resp.status_code) + " :: " + str(resp.json()["error"]))
         return True
@@ -84,7 +84,7 @@ class Snapshot():
     @classmethod
     def delete_repository(cls, repo):
         url = ElasticSettings.url() + '/_snapshot/' + repo
-        resp = requests.delete(url)
+        resp = Transport.get_transport().delete(url)
         if resp.status_code != 200:
             logger.error("Status ("+url+"): "+str(resp.status_code) + " :: " + str(resp.json()["error"]))
             return False
@@ -95,7 +95,7 @@ class Snapshot():
         ''' Create a snapshot for the specified indices or all if
         indices is None. '''
         url = ElasticSettings.url() + '/_snapshot/' + repo + '/' + snapshot + '?wait_for_completion=true'
-        resp = requests.get(url)
+        resp = Transport.get_transport().get(url)
         if resp.status_code == 200:
             logger.error("Snapshot "+snapshot+" already exists!")
             return False
@@ -103,7 +103,7 @@ class Snapshot():
         data = {}
         if indices is not None:
             data = {"indices": indices}
-        resp = requests.put(url, data=json.dumps(data))
+        resp = Transport.get_transport().put(url, data=json.dumps(data))
         if resp.status_code != 200:
             logger.error("Snapshot "+snapshot+" create error! :: " + str(resp.json()["error"]))
         return True
@@ -111,7 +111,7 @@ class Snapshot():
     @classmethod
     def delete_snapshot(cls, repo, snapshot):
         url = ElasticSettings.url() + '/_snapshot/' + repo + '/' + snapshot
-        resp = requests.delete(url)
+        resp = Transport.get_transport().delete(url)
         if resp.status_code != 200:
             logger.error("Status ("+url+"): "+str(resp.status_code) + " :: " + str(resp.json()["error"]))
 
@@ -121,6 +121,6 @@ class Snapshot():
         data = {}
         if indices is not None:
             data = {"indices": indices}
-        resp = requests.post(url, data=json.dumps(data))
+        resp = Transport.get_transport().post(url, data=json.dumps(data))
         if resp.status_code != 200:
             logger.error("Status ("+url+"): "+str(resp.status_code) + " :: " + str(resp.json()["error"]))
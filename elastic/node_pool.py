@@ -0,0 +1,219 @@
+''' Health checked pool of the Elastic nodes listed in the ELASTIC_URL setting.
+
+A L{NodePool} tracks the latency and error rate of each node. Nodes that
+fail are taken out of rotation for a cooldown period and are probed in a
+background thread until they respond again. Requests are spread across the
+healthy nodes using either round-robin or least-latency selection, I{e.g.}::
+
+    ELASTIC = {
+        'default': {
+            'ELASTIC_URL': ['http://node1:9200/', 'http://node2:9200/'],
+            'NODE_SELECTOR': 'least_latency',   # or 'round_robin' (default)
+            'NODE_COOLDOWN': 30,                # seconds a sick node is left out
+            'NODE_MAX_FAILURES': 1,             # consecutive failures before cooldown
+            'NODE_MAX_ERROR_RATE': 0.5,         # error rate before cooldown
+            'NODE_PROBE_INTERVAL': 5,           # seconds between probes of sick nodes
+        }
+    }
+'''
+import random
+import threading
+import time
+import logging
+import requests
+
+# Get an instance of a logger
+logger = logging.getLogger(__name__)
+
+
+class Node(object):
+    ''' Health statistics for an Elastic node. '''
+
+    LATENCY_WEIGHT = 0.3
+    ERROR_WEIGHT = 0.1
+
+    def __init__(self, url):
+        self.url = url
+        self.base_url = url.rstrip('/')
+        self.latency = None
+        self.error_rate = 0.
+        self.requests = 0
+        self.failures = 0
+        self.consecutive_failures = 0
+        self.alive = True
+        self.retry_at = 0
+
+    def is_alive(self):
+        ''' Return True if the node is in rotation. '''
+        return self.alive
+
+    def record_success(self, latency):
+        ''' Update the latency and error rate moving averages for a success. '''
+        self.requests += 1
+        self.consecutive_failures = 0
+        if self.latency is None:
+            self.latency = latency
+        else:
+            self.latency += Node.LATENCY_WEIGHT * (latency - self.latency)
+        self.error_rate -= Node.ERROR_WEIGHT * self.error_rate
+
+    def record_failure(self):
+        ''' Update the error rate moving average for a failure. '''
+        self.requests += 1
+        self.failures += 1
+        self.consecutive_failures += 1
+        self.error_rate += Node.ERROR_WEIGHT * (1. - self.error_rate)
+
+    def stats(self):
+        return {"url": self.url, "alive": self.is_alive(), "latency": self.latency,
+                "error_rate": self.error_rate, "requests": self.requests, "failures": self.failures}
+
+
+class NodePool(object):
+    ''' Select healthy nodes from a list of Elastic URLs. '''
+
+    ROUND_ROBIN = 'round_robin'
+    LEAST_LATENCY = 'least_latency'
+    POOLS = {}
+    _lock = threading.Lock()
+
+    def __init__(self, urls, selector=ROUND_ROBIN, cooldown=30, max_failures=1,
+                 max_error_rate=0.5, probe_interval=5, probe_timeout=2):
+        ''' Set up the pool.
+        @type  urls: list
+        @param urls: Elastic node URLs.
+        @type  selector: string
+        @keyword selector: 'round_robin' or 'least_latency' node selection.
+        @type  cooldown: float
+        @keyword cooldown: Seconds a sick node is taken out of rotation.
+        @type  max_failures: integer
+        @keyword max_failures: Consecutive failures before a node is taken out of rotation.
+        @type  max_error_rate: float
+        @keyword max_error_rate: Error rate (0-1) before a node is taken out of rotation.
+        @type  probe_interval: float
+        @keyword probe_interval: Seconds between background probes of sick nodes.
+        @type  probe_timeout: float
+        @keyword probe_timeout: Timeout used when probing a sick node.
+        '''
+        if selector not in (NodePool.ROUND_ROBIN, NodePool.LEAST_LATENCY):
+            raise ValueError("node selector not recognised: " + str(selector))
+        self.nodes = [Node(url) for url in urls]
+        self.selector = selector
+        self.cooldown = cooldown
+        self.max_failures = max_failures
+        self.max_error_rate = max_error_rate
+        self.probe_interval = probe_interval
+        self.probe_timeout = probe_timeout
+        self._next = 0
+        self._lock = threading.RLock()
+        self._prober = None
+
+    @classmethod
+    def get_pool(cls, urls, **pool_options):
+        ''' Return the shared pool for a list of URLs and pool options. '''
+        key = (tuple(urls), tuple(sorted(pool_options.items())))
+        pool = NodePool.POOLS.get(key)
+        if pool is None:
+            with NodePool._lock:
+                pool = NodePool.POOLS.get(key)
+                if pool is None:
+                    pool = cls(urls, **pool_options)
+                    NodePool.POOLS[key] = pool
+        return pool
+
+    @classmethod
+    def reset(cls):
+        ''' Forget all node statistics. '''
+        with NodePool._lock:
+            NodePool.POOLS = {}
+
+    def healthy_nodes(self):
+        return [node for node in self.nodes if node.is_alive()]
+
+    def select(self, exclude=None):
+        ''' Return the URL of a healthy node. If no node is healthy the node
+        due to be probed first is returned. '''
+        with self._lock:
+            nodes = [n for n in self.healthy_nodes() if exclude is None or n.url not in exclude]
+            if len(nodes) == 0:
+                nodes = [n for n in self.nodes if exclude is None or n.url not in exclude]
+                if len(nodes) == 0:
+                    return None
+                return min(nodes, key=lambda n: n.retry_at).url
+
+            if self.selector == NodePool.LEAST_LATENCY:
+                # power of two choices - the faster of two random nodes, untried nodes first
+                pair = random.sample(nodes, min(2, len(nodes)))
+                node = min(pair, key=lambda n: -1 if n.latency is None else n.latency)
+            else:
+                node = nodes[self._next % len(nodes)]
+                self._next += 1
+            return node.url
+
+    def node_for(self, url):
+        ''' Return the L{Node} that a request URL is sent to. '''
+        for node in self.nodes:
+            if url.startswith(node.base_url):
+                return node
+        return None
+
+    def mark_success(self, node, latency):
+        with self._lock:
+            node.record_success(latency)
+
+    def mark_failure(self, node):
+        ''' Record a failure and take the node out of rotation if it is sick. '''
+        with self._lock:
+            node.record_failure()
+            if (node.consecutive_failures >= self.max_failures or
+                    (node.requests >= 10 and node.error_rate > self.max_error_rate)):
+                if node.is_alive():
+                    logger.warn("Elastic node "+node.url+" out of rotation for "+str(self.cooldown)+"s")
+                node.alive = False
+                node.retry_at = time.time() + self.cooldown
+                self._start_prober()
+
+    def revive(self, node):
+        ''' Put a node back into rotation. '''
+        with self._lock:
+            logger.info("Elastic node "+node.url+" back in rotation")
+            node.alive = True
+            node.consecutive_failures = 0
+            node.error_rate = 0.
+
+    def _start_prober(self):
+        if self._prober is None or not self._prober.is_alive():
+            self._prober = threading.Thread(target=self._probe_loop, name='elastic-node-probe')
+            self._prober.daemon = True
+            self._prober.start()
+
+    def _probe_loop(self):
+        ''' Probe sick nodes once their cooldown has elapsed and put them back into
+        rotation when they respond. Runs until all nodes are healthy. '''
+        session = requests.Session()
+        try:
+            while True:
+                time.sleep(self.probe_interval)
+                with self._lock:
+                    sick = [n for n in self.nodes if not n.is_alive()]
+                if len(sick) == 0:
+                    return
+                for node in sick:
+                    if node.retry_at > time.time():
+                        continue
+                    try:
+                        resp = session.get(node.base_url + '/', timeout=self.probe_timeout)
+                        if resp.status_code == 200:
+                            self.revive(node)
+                            continue
+                    except requests.exceptions.RequestException:
+                        pass
+                    with self._lock:
+                        node.retry_at = time.time() + self.cooldown
+        finally:
+            session.close()
+
+    def stats(self):
+        ''' Return the health statistics of the nodes. '''
+        with self._lock:
+            return [node.stats() for node in self.nodes]
@@ -5,7 +5,7 @@ class Result(object):
     ''' Result container for Document and Aggregation stores. '''
 
     def __init__(self, took=None, hits_total=None, size=None,
-                 docs=None, aggs=None, idx=None, query=None):
+                 docs=None, aggs=None, idx=None, query=None, error=None):
         ''' Store Documents and Aggregations and search meta data.
         @type  took: integer
         @keyword took: Time in milliseconds for search to run.
@@ -21,6 +21,8 @@ class Result(object):
         @keyword idx: Indices searched.
         @type  query: dict
         @keyword query: search query
+        @type  error: dict
+        @keyword error: Error returned by the search (I{e.g.} in a multi search).
         '''
         self.took = took
         self.hits_total = hits_total
@@ -29,6 +31,7 @@ class Result(object):
         self.aggs = aggs
         self.idx = idx
         self.query = query
+        self.error = error
 
 
 class Document(object):
@@ -15,10 +15,17 @@ exact components needed for the query then look into building it
 from the L{Query} and L{Filter} parent and child classes.
 '''
 import json
-import requests
 import logging
+import queue
+import random
+import threading
+import time
+import requests
 from elastic.result import Document, Result, Aggregation
-from elastic.elastic_settings import ElasticSettings, ElasticUrl
+from elastic.elastic_settings import ElasticSettings
+from elastic.transport import Transport
+from elastic.cache import SearchCache
+from elastic.stream import JsonStream
 from elastic.query import Query, QueryError, BoolQuery, RangeQuery, FilteredQuery,\
     Filter, OrFilter, HasParentQuery, HasChildQuery
 from builtins import classmethod
@@ -87,22 +94,16 @@ class Search:
             self.url = (self.idx + '/' + self.idx_type + '/_search?search_type='+search_type)
 
     @classmethod
-    def elastic_request(cls, elastic_url, url, data=None, is_post=True):
-        ''' Make GET/POST request and return response from elastic server. '''
-        try:
-            if is_post:
-                response = requests.post(elastic_url + '/' + url, data=data)
-            else:
-                response = requests.get(elastic_url + '/' + url)
-        except requests.exceptions.ConnectionError:
-            logger.error('ConnectionError ' + elastic_url)
-            ElasticUrl.rotate_url()
-            elastic_url = ElasticUrl.get_url()
-            if is_post:
-                response = requests.post(elastic_url + '/' + url, data=data)
-            else:
-                response = requests.get(elastic_url + '/' + url)
-        return response
+    def elastic_request(cls, elastic_url, url, data=None, is_post=True, coalesce=False):
+        ''' Make GET/POST request and return response from elastic server. If
+        coalesce is set and the COALESCE_SEARCHES setting is on (default) then
+        identical requests made concurrently share one response. '''
+        transport = Transport.get_transport()
+        if coalesce and ElasticSettings.getattr('COALESCE_SEARCHES', default=True):
+            return transport.coalesced_request('POST' if is_post else 'GET', elastic_url + '/' + url, data=data)
+        if is_post:
+            return transport.post(elastic_url + '/' + url, data=data)
+        return transport.get(elastic_url + '/' + url)
 
     @classmethod
     def index_exists(cls, idx, idx_type='', url=None):
@@ -120,9 +121,11 @@ class Search:
     def index_refresh(cls, idx, url=None):
         ''' Refresh to make all operations performed since the last refresh
         available for search'''
-        if url is None:
+        elastic_url = url
+        if elastic_url is None:
             elastic_url = ElasticSettings.url()
         response = Search.elastic_request(elastic_url, idx + '/_refresh')
+        SearchCache.invalidate(idx)
         if "error" in response.json():
             logger.warn(response.content.decode("utf-8"))
             return False
@@ -170,28 +173,129 @@ class Search:
         data = {}
         if hasattr(self, 'query'):
             data = json.dumps(self.query)
-        response = Search.elastic_request(ElasticSettings.url(), url, data=data)
+        response = Search.elastic_request(ElasticSettings.url(), url, data=data, coalesce=True)
         return response.json()
 
     def get_json_response(self):
-        ''' Return the elastic json response '''
-        response = Search.elastic_request(self.elastic_url, self.url, data=json.dumps(self.query))
+        ''' Return the elastic json response. If a L{SearchCache} is configured
+        successful responses are cached. '''
+        cache = SearchCache.get_cache()
+        if cache is not None:
+            cache_key = cache.search_key(self)
+            content = cache.get(cache_key)
+            if content is not None:
+                return json.loads(content)
+
+        response = Search.elastic_request(self.elastic_url, self.url, data=json.dumps(self.query), coalesce=True)
         logger.debug("curl '" + self.elastic_url + '/' + self.url + "&pretty' -d '" + json.dumps(self.query) + "'")
         if response.status_code != 200:
             logger.warn("Error: elastic response 200:" + self.url)
+        elif cache is not None:
+            cache.set(cache_key, response.content.decode("utf-8"))
         return response.json()
 
     def search(self):
         ''' Run the search and return a L{Result} that stores the
         L{Document} and L{Aggregation} objects. '''
-        json_response = self.get_json_response()
+        return self._build_result(self.get_json_response())
+
+    def iter_hits(self, chunk_size=65536):
+        ''' Run the search and yield the hits one at a time as they are parsed
+        from the response, rather than reading the whole response into memory.
+        Use for searches with a large size. Responses are not cached. '''
+        url = self.elastic_url + '/' + self.url
+        response = Transport.get_transport().post(url, data=json.dumps(getattr(self, 'query', {})), stream=True)
+        try:
+            if response.status_code != 200:
+                logger.warn("Error: elastic response 200:" + self.url)
+                return
+            for hit in JsonStream(response.iter_content(chunk_size), path=('hits', 'hits')):
+                yield hit
+        finally:
+            response.close()
+
+    def iter_docs(self, chunk_size=65536):
+        ''' Run the search and yield a L{Document} for each hit (see L{iter_hits}). '''
+        for hit in self.iter_hits(chunk_size=chunk_size):
+            yield Document(hit)
+
+    def _build_result(self, json_response):
+        ''' Build the L{Result} for a search response. '''
         hits = json_response['hits']['hits']
         docs = [Document(hit) for hit in hits]
         aggs = Aggregation.build_aggs(json_response)
         return Result(took=json_response['took'],
                       hits_total=json_response['hits']['total'],
                       size=self.size, docs=docs, aggs=aggs,
-                      idx=self.idx, query=self.query)
+                      idx=self.idx, query=getattr(self, 'query', None))
+
+
+class MultiSearch(object):
+    ''' Run a list of L{Search} objects in a single
+    U{multi search<www.elastic.co/guide/en/elasticsearch/reference/current/search-multi-search.html>}
+    request. '''
+
+    def __init__(self, searches, elastic_url=None, max_searches=500):
+        ''' Set up the searches to run together.
+        @type  searches: list
+        @param searches: L{Search} objects to run.
+        @type  elastic_url: string
+        @keyword elastic_url: Elastic URL (default: default cluster URL).
+        @type  max_searches: integer
+        @keyword max_searches: Maximum number of searches sent per request (default: 500).
+        '''
+        for search in searches:
+            if not isinstance(search, Search):
+                raise QueryError("not a Search")
+        if elastic_url is None:
+            elastic_url = ElasticSettings.url()
+        self.searches = list(searches)
+        self.elastic_url = elastic_url
+        self.max_searches = max_searches
+
+    @classmethod
+    def msearch_body(cls, searches):
+        ''' Return the multi search request body (header and body line per search). '''
+        lines = []
+        for search in searches:
+            header = {"index": search.idx}
+            if search.idx_type:
+                header["type"] = search.idx_type
+            body = dict(getattr(search, 'query', {}))
+            if search.search_type is None:
+                body.update({"size": search.size, "from": search.search_from})
+            else:
+                header["search_type"] = search.search_type
+            lines.append(json.dumps(header))
+            lines.append(json.dumps(body))
+        return '\n'.join(lines) + '\n'
+
+    def get_json_response(self):
+        ''' Return a list of the elastic json responses, one per search. A
+        search that failed has an 'error' in its response. '''
+        responses = []
+        for i in range(0, len(self.searches), self.max_searches):
+            searches = self.searches[i:i+self.max_searches]
+            response = Search.elastic_request(self.elastic_url, '_msearch', data=MultiSearch.msearch_body(searches))
+            if response.status_code != 200:
+                logger.warn("Error: elastic response 200: _msearch")
+                error = {"error": response.content.decode("utf-8"), "status": response.status_code}
+                responses.extend([error for _ in searches])
+            else:
+                responses.extend(response.json()['responses'])
+        return responses
+
+    def search(self):
+        ''' Run the searches and return a list of L{Result}, one per search. A
+        search that failed returns a L{Result} with the error set and no docs. '''
+        results = []
+        for search, json_response in zip(self.searches, self.get_json_response()):
+            if 'error' in json_response:
+                results.append(Result(size=search.size, docs=[], idx=search.idx,
+                                      query=getattr(search, 'query', None), error=json_response['error']))
+            else:
+                results.append(search._build_result(json_response))
+        return results
 
 
 class Sort():
@@ -222,18 +326,158 @@ class Sort():
 
 
 class ScanAndScroll(object):
-    ''' Use Elastic scan and scroll api. '''
+    ''' Use Elastic scan and scroll api. Pages of hits are fetched in worker
+    threads so that the next page is fetched while the current one is being
+    processed. For Elastic 5+ an index can be read with parallel
+    U{sliced scrolls<www.elastic.co/guide/en/elasticsearch/reference/current/search-request-scroll.html>}. '''
+
+    # marks the end of a slice in the page queue
+    _SLICE_DONE = object()
 
     @classmethod
     def scan_and_scroll(self, idx, call_fun=None, idx_type='', url=None,
-                        time_to_keep_scoll=1, query=None):
+                        time_to_keep_scoll=1, query=None, slices=1):
         ''' Scan and scroll an index and optionally provide a function argument to
         process the hits. '''
+        count = 0
+        for resp_json in ScanAndScroll.iter_pages(idx, idx_type=idx_type, url=url,
+                                                  time_to_keep_scoll=time_to_keep_scoll,
+                                                  query=query, slices=slices):
+            count += len(resp_json['hits']['hits'])
+            if call_fun is not None:
+                call_fun(resp_json)
+        logger.debug("Scanned No. Docs ( "+idx+"/"+idx_type+" ) = "+str(count))
+
+    @classmethod
+    def iter_docs(cls, idx, idx_type='', url=None, time_to_keep_scoll=1, query=None,
+                  slices=1, prefetch=2):
+        ''' Scan and scroll an index and yield a L{Document} for each hit. '''
+        for resp_json in cls.iter_pages(idx, idx_type=idx_type, url=url, time_to_keep_scoll=time_to_keep_scoll,
+                                        query=query, slices=slices, prefetch=prefetch):
+            for hit in resp_json['hits']['hits']:
+                yield Document(hit)
+
+    @classmethod
+    def iter_pages(cls, idx, idx_type='', url=None, time_to_keep_scoll=1, query=None,
+                   slices=1, prefetch=2):
+        ''' Scan and scroll an index and yield the JSON response for each page of hits.
+        The scroll contexts are cleared when the iteration ends, fails or is stopped.
+        @type  idx: string
+        @param idx: Index to scroll.
+        @type  idx_type: string
+        @keyword idx_type: Index type (default: '').
+        @type  url: string
+        @keyword url: Elastic URL (default: default cluster URL).
+        @type  time_to_keep_scoll: integer
+        @keyword time_to_keep_scoll: Minutes to keep the scroll context alive between pages.
+        @type  query: L{ElasticQuery}
+        @keyword query: Query to select the documents (default: match all).
+        @type  slices: integer
+        @keyword slices: Number of sliced scrolls read in parallel (Elastic 5+, default: 1).
+        @type  prefetch: integer
+        @keyword prefetch: Number of pages fetched ahead for each slice (default: 2).
+        '''
+        if url is None:
+            url = ElasticSettings.url()
+        if slices > 1 and ElasticSettings.version()['major'] < 5:
+            logger.warn("Sliced scroll requires Elastic 5+, scrolling "+idx+" with one slice")
+            slices = 1
+
+        pages = queue.Queue(maxsize=max(prefetch, 1) * slices)
+        stop = threading.Event()
+        workers = []
+        for slice_id in range(slices):
+            (url_search_scan, query_dict) = \
+                ScanAndScroll._scan_request(idx, idx_type, time_to_keep_scoll, query,
+                                            slice_id=(slice_id if slices > 1 else None), max_slices=slices)
+            worker = threading.Thread(target=cls._scroll_slice, name='elastic-scroll-'+str(slice_id),
+                                      args=(url, url_search_scan, query_dict, time_to_keep_scoll, pages, stop))
+            worker.daemon = True
+            worker.start()
+            workers.append(worker)
+
+        try:
+            running = slices
+            while running > 0:
+                page = pages.get()
+                if page is ScanAndScroll._SLICE_DONE:
+                    running -= 1
+                elif isinstance(page, Exception):
+                    raise page
+                else:
+                    yield page
+        finally:
+            stop.set()
+            # unblock workers waiting to queue a page
+            while any(worker.is_alive() for worker in workers):
+                try:
+                    pages.get(timeout=0.1)
+                except queue.Empty:
+                    pass
+
+    @classmethod
+    def _scroll_slice(cls, url, url_search_scan, query, time_to_keep_scoll, pages, stop):
+        ''' Worker that scrolls a slice and puts the pages of hits on the queue. '''
+        scroll_id = None
+        try:
+            response = Search.elastic_request(url, url_search_scan, data=json.dumps(query))
+            resp_json = ScanAndScroll._scroll_json(response)
+            scroll_id = resp_json.get('_scroll_id')
+            url_scan_scroll = '_search/scroll?scroll=' + str(time_to_keep_scoll) + 'm'
+            # the scan search type returns no hits in the first response
+            is_scan = 'search_type=scan' in url_search_scan
+            while not stop.is_set():
+                scroll_id = resp_json.get('_scroll_id', scroll_id)
+                if len(resp_json['hits']['hits']) > 0:
+                    ScanAndScroll._put(pages, resp_json, stop)
+                elif not is_scan:
+                    break
+                is_scan = False
+                response = Search.elastic_request(url, url_scan_scroll, data=scroll_id)
+                resp_json = ScanAndScroll._scroll_json(response)
+        except Exception as e:
+            ScanAndScroll._put(pages, e, stop)
+        finally:
+            if scroll_id is not None:
+                ScanAndScroll.clear_scroll(scroll_id, url=url)
+            ScanAndScroll._put(pages, ScanAndScroll._SLICE_DONE, stop)
+
+    @classmethod
+    def _scroll_json(cls, response):
+        if response.status_code != 200:
+            raise QueryError("scroll failed: " + response.content.decode("utf-8"))
+        return response.json()
+
+    @classmethod
+    def _put(cls, pages, page, stop):
+        ''' Queue a page unless the consumer has stopped. '''
+        while not stop.is_set():
+            try:
+                pages.put(page, timeout=0.1)
+                return
+            except queue.Full:
+                pass
+
+    @classmethod
+    def clear_scroll(cls, scroll_id, url=None):
+        ''' Clear a scroll context to free its resources. '''
         if url is None:
             url = ElasticSettings.url()
+        try:
+            Transport.get_transport().delete(url.rstrip('/') + '/_search/scroll',
+                                             data=json.dumps({"scroll_id": [scroll_id]}))
+        except requests.exceptions.RequestException:
+            logger.warn("Failed to clear scroll " + scroll_id)
 
-        url_search_scan = (idx + '/' + idx_type + '/_search?search_type=scan&scroll=' +
-                           str(time_to_keep_scoll) + 'm')
+    @classmethod
+    def _scan_request(cls, idx, idx_type, time_to_keep_scoll, query, slice_id=None, max_slices=None):
+        ''' Return the scan URL path and query used to start scanning an index. '''
+        if ElasticSettings.version()['major'] < 5:
+            url_search_scan = (idx + '/' + idx_type + '/_search?search_type=scan&scroll=' +
+                               str(time_to_keep_scoll) + 'm')
+        else:
+            # the scan search type was removed, sort on _doc for the same efficiency
+            url_search_scan = (idx + '/' + idx_type + '/_search?scroll=' + str(time_to_keep_scoll) + 'm')
         if query is None:
             query = {
                 "query": {"match_all": {}},
@@ -242,24 +486,12 @@ class ScanAndScroll(object):
         else:
             if not isinstance(query, ElasticQuery):
                 raise QueryError("not a Query")
-            query = query.query
-
-        response = Search.elastic_request(url, url_search_scan, data=json.dumps(query))
-        _scroll_id = response.json()['_scroll_id']
-        url_scan_scroll = '_search/scroll?scroll=' + str(time_to_keep_scoll) + 'm'
-
-        count = 0
-        while True:
-            response = Search.elastic_request(url, url_scan_scroll, data=_scroll_id)
-            _scroll_id = response.json()['_scroll_id']
-            hits = response.json()['hits']['hits']
-            nhits = len(hits)
-            if nhits == 0:
-                break
-            count += nhits
-            if call_fun is not None:
-                call_fun(response.json())
-        logger.debug("Scanned No. Docs ( "+idx+"/"+idx_type+" ) = "+str(count))
+            query = dict(query.query)
+        if ElasticSettings.version()['major'] >= 5:
+            query.setdefault("sort", ["_doc"])
+            if slice_id is not None:
+                query["slice"] = {"id": slice_id, "max": max_slices}
+        return (url_search_scan, query)
 
 
 class Suggest(object):
@@ -293,6 +525,9 @@ class Suggest(object):
 class Update(object):
     ''' Update API. '''
 
+    # sets each field of params.doc on the document
+    SET_FIELDS_SCRIPT = "for (entry in params.doc.entrySet()) { ctx._source[entry.getKey()] = entry.getValue(); }"
+
     @classmethod
     def update_doc(cls, doc, part_doc, elastic_url=None):
         ''' Update a document with a partial document.  '''
@@ -301,6 +536,7 @@ class Update(object):
         url = (doc._meta['_index'] + '/' +
                doc.type() + '/' + doc._meta['_id'] + '/_update')
         response = Search.elastic_request(elastic_url, url, data=json.dumps(part_doc))
+        SearchCache.invalidate(doc._meta['_index'])
 
         logger.debug("curl -XPOST '" + elastic_url + url + "' -d '" + json.dumps(part_doc) + "'")
         if response.status_code != 200:
@@ -308,26 +544,137 @@ class Update(object):
             logger.warn(response.json())
         return response.json()
 
+    @classmethod
+    def update_by_query(cls, idx, part_doc, idx_type='', query=None, slices=1, elastic_url=None, poll=5):
+        ''' Set the fields of a partial document on all the documents matching a
+        query, on the cluster, with the
+        U{update by query API<www.elastic.co/guide/en/elasticsearch/reference/current/docs-update-by-query.html>}.
+        The update runs as a task that is polled until it completes. Documents
+        changed while it runs (version conflicts) are skipped and reported. Unlike
+        a partial document update, object fields are replaced rather than merged.
+        Needs Elastic 5+ (painless scripts), on older versions None is returned.
+        @type  idx: string
+        @param idx: Index to update.
+        @type  part_doc: dict
+        @param part_doc: Fields to set.
+        @type  idx_type: string
+        @keyword idx_type: Index type (default: '').
+        @type  query: L{ElasticQuery}
+        @keyword query: Query to select the documents (default: match all).
+        @type  slices: integer
+        @keyword slices: Number of slices the update is run in.
+        @type  poll: integer
+        @keyword poll: Seconds between checks of the task.
+        @return: the number of documents updated
+        '''
+        major = ElasticSettings.version()['major']
+        if major < 5:
+            logger.warn("update by query with painless scripts needs Elastic 5+")
+            return None
+        if elastic_url is None:
+            elastic_url = ElasticSettings.url()
+
+        script = {"lang": "painless", "params": {"doc": part_doc}}
+        script["source" if major >= 6 else "inline"] = Update.SET_FIELDS_SCRIPT
+        data = {"script": script}
+        if query is not None:
+            data["query"] = query.query["query"]
+        url = (idx + '/' + (idx_type + '/' if idx_type else '') +
+               '_update_by_query?wait_for_completion=false&conflicts=proceed')
+        if slices > 1:
+            url += '&slices=' + str(slices)
+        response = Search.elastic_request(elastic_url, url, data=json.dumps(data))
+        if response.status_code != 200:
+            raise QueryError("update by query failed: " + str(response.content))
+        result = Task.wait(response.json()['task'], elastic_url=elastic_url, poll=poll)
+        SearchCache.invalidate(idx)
+        if len(result.get('failures', [])) > 0:
+            logger.error("ERROR: update by query of "+idx+" failures: "+str(result['failures'][:10]))
+        if result.get('version_conflicts', 0) > 0:
+            logger.warn("WARNING: update by query of "+idx+" skipped "+str(result['version_conflicts']) +
+                        " documents changed during the update (version conflicts)")
+        return result.get('updated', 0)
+
+
+class Task(object):
+    ''' U{Task management API<www.elastic.co/guide/en/elasticsearch/reference/current/tasks.html>}. '''
+
+    @classmethod
+    def wait(cls, task_id, elastic_url=None, poll=5):
+        ''' Wait for a task to complete and return its response. '''
+        if elastic_url is None:
+            elastic_url = ElasticSettings.url()
+        while True:
+            response = Search.elastic_request(elastic_url, '_tasks/' + task_id, is_post=False)
+            if response.status_code != 200:
+                raise QueryError("task " + task_id + " status: " + str(response.status_code))
+            task = response.json()
+            if task.get('completed'):
+                if 'error' in task:
+                    raise QueryError("task " + task_id + " failed: " + str(task['error']))
+                return task.get('response', {})
+            status = task.get('task', {}).get('status', {})
+            logger.info("task " + task_id + ": " + str(status.get('updated', 0) + status.get('deleted', 0)) +
+                        " of " + str(status.get('total', '?')) + " documents")
+            time.sleep(poll)
+
 
 class Delete(object):
 
     @classmethod
-    def docs_by_query(cls, idx, idx_type='', query=Query.match_all()):
-        ''' Delete all documents specified by a Query. '''
-        query = ElasticQuery(query, sources='_id')
-        chunk_size = 1000
-        search_from = 0
-        hits_total = 10
-        while search_from < hits_total:
-            res = Search(query, idx=idx, idx_type=idx_type, size=chunk_size, search_from=search_from).search()
-            hits_total = res.hits_total
-            search_from += chunk_size
-            docs = res.docs
-            json_data = ''
-            for doc in docs:
-                json_data += '{"delete": {"_index": "%s", "_type": "%s", "_id": "%s"}}\n' % \
-                             (doc.index(), doc.type(), doc.doc_id())
-            Bulk.load(idx, idx_type, json_data)
+    def docs_by_query(cls, idx, idx_type='', query=Query.match_all(), slices=1, threads=2, server_side=False,
+                      poll=5):
+        ''' Delete all documents specified by a Query and return the number deleted.
+        The ids of the documents are walked with a (sliced) scroll and the deletes
+        are sent in parallel by a L{BulkIndexer<elastic.bulk.BulkIndexer>}. With
+        server_side set the cluster deletes the documents using the
+        U{delete by query API<www.elastic.co/guide/en/elasticsearch/reference/current/docs-delete-by-query.html>}
+        where it is available (Elastic 5+).
+        @type  idx: string
+        @param idx: Index to delete documents from.
+        @type  idx_type: string
+        @keyword idx_type: Index type (default: '').
+        @type  query: L{Query}
+        @keyword query: Query selecting the documents to delete (default: match all).
+        @type  slices: integer
+        @keyword slices: Number of slices the documents are scrolled in.
+        @type  threads: integer
+        @keyword threads: Number of threads sending the delete requests.
+        @type  server_side: bool
+        @keyword server_side: Use delete by query (default: False).
+        @type  poll: integer
+        @keyword poll: Seconds between checks of the delete by query task.
+        @return: the number of documents deleted
+        '''
+        if server_side and ElasticSettings.version()['major'] >= 5:
+            return Delete._delete_by_query(idx, idx_type, query, slices, poll)
+
+        from elastic.bulk import BulkBuffer, BulkIndexer
+        scroll_query = ElasticQuery(query, sources=False)
+        scroll_query.query["size"] = 1000
+        with BulkIndexer(idx, idx_type, threads=threads) as indexer:
+            with BulkBuffer(indexer.add, max_docs=1000) as buf:
+                for resp_json in ScanAndScroll.iter_pages(idx, idx_type=idx_type, query=scroll_query, slices=slices):
+                    for hit in resp_json['hits']['hits']:
+                        buf.add({"delete": {"_index": hit['_index'], "_type": hit['_type'], "_id": hit['_id']}})
+        SearchCache.invalidate(idx)
+        return indexer.stats()['accepted']
+
+    @classmethod
+    def _delete_by_query(cls, idx, idx_type, query, slices, poll):
+        ''' Delete the documents on the cluster, polling the task until it completes. '''
+        elastic_url = ElasticSettings.url()
+        url = idx + '/' + (idx_type + '/' if idx_type else '') + '_delete_by_query?wait_for_completion=false'
+        if slices > 1:
+            url += '&slices=' + str(slices)
+        response = Search.elastic_request(elastic_url, url, data=json.dumps({"query": query.query}))
+        if response.status_code != 200:
+            raise QueryError("delete by query failed: " + str(response.content))
+        result = Task.wait(response.json()['task'], elastic_url=elastic_url, poll=poll)
+        SearchCache.invalidate(idx)
+        if len(result.get('failures', [])) > 0:
+            logger.error("ERROR: delete by query of "+idx+" failures: "+str(result['failures'][:10]))
+        return result.get('deleted', 0)
 
 
 class Bulk(object):
@@ -338,8 +685,9 @@ class Bulk(object):
         ''' Bulk load documents. '''
         if elastic_url is None:
             elastic_url = ElasticSettings.url()
-        resp = requests.put(ElasticSettings.url()+'/' + idx+'/' + idx_type +
-                            '/_bulk', data=json_data)
+        resp = Transport.get_transport().put(elastic_url+'/' + idx+'/' + idx_type +
+                                             '/_bulk', data=json_data)
+        SearchCache.invalidate(idx)
         if(resp.status_code != 200):
             logger.error('ERROR: '+idx+' load status: '+str(resp.status_code)+' '+str(resp.content))
 
@@ -353,6 +701,155 @@ class Bulk(object):
                         logger.error(item)
         return resp
 
+    # item failures that are worth retrying
+    RETRY_STATUS = (429, 503)
+    RETRY_ERRORS = ('es_rejected_execution_exception',)
+    MAX_RETRIES = 3
+    BACKOFF = 0.5
+    _dead_letter_lock = threading.Lock()
+
+    @classmethod
+    def load_chunk(cls, idx, idx_type, json_data, elastic_url=None, max_retries=None, dead_letter=None):
+        ''' Bulk load documents and return the number of documents accepted
+        and failed. Items rejected because the cluster is busy (I{e.g.} a 429)
+        are resubmitted on their own, with exponential backoff and jitter,
+        up to max_retries times. Items that still fail are appended to the
+        dead letter file so that they can be replayed with L{replay}. As retried
+        items are sent after the rest of the chunk, actions on the same document
+        within a chunk may be applied out of order.
+        @type  max_retries: integer
+        @keyword max_retries: Number of retries (default: BULK_MAX_RETRIES setting or 3).
+        @type  dead_letter: string
+        @keyword dead_letter: NDJSON file for failed items (default: BULK_DEAD_LETTER setting).
+        '''
+        if max_retries is None:
+            max_retries = ElasticSettings.getattr('BULK_MAX_RETRIES', default=Bulk.MAX_RETRIES)
+        if dead_letter is None:
+            dead_letter = ElasticSettings.getattr('BULK_DEAD_LETTER')
+        backoff = ElasticSettings.getattr('BULK_BACKOFF', default=Bulk.BACKOFF)
+
+        actions = Bulk.split_actions(json_data)
+        accepted = 0
+        failed = []
+        attempt = 0
+        while len(actions) > 0:
+            (ok, retry, failed_items) = Bulk._load_actions(idx, idx_type, actions, elastic_url)
+            accepted += ok
+            failed.extend(failed_items)
+            if len(retry) == 0:
+                break
+            if attempt >= max_retries:
+                failed.extend(retry)
+                break
+            delay = random.uniform(0, backoff * (2 ** attempt))
+            logger.warning("Retrying "+str(len(retry))+" rejected bulk items for "+idx+" in " +
+                           str(round(delay, 2))+"s")
+            time.sleep(delay)
+            attempt += 1
+            actions = [(action, source) for action, source, _error in retry]
+
+        if len(failed) > 0:
+            logger.error("ERROR: "+str(len(failed))+" bulk items failed to load into "+idx)
+            if dead_letter is not None:
+                Bulk._write_dead_letter(dead_letter, idx, idx_type, failed)
+        return (accepted, len(failed))
+
+    @classmethod
+    def _load_actions(cls, idx, idx_type, actions, elastic_url):
+        ''' Send the actions and return the number accepted, the items to retry
+        and the items that failed, as (action, source, error) tuples. '''
+        if elastic_url is None:
+            elastic_url = ElasticSettings.url()
+        json_data = ''.join(action + '\n' + (source + '\n' if source is not None else '')
+                            for action, source in actions)
+        try:
+            resp = Transport.get_transport().put(elastic_url+'/' + idx+'/' + idx_type + '/_bulk', data=json_data)
+        except requests.exceptions.RequestException as e:
+            logger.error('ERROR: '+idx+' bulk request failed: '+str(e))
+            return (0, [(action, source, str(e)) for action, source in actions], [])
+        SearchCache.invalidate(idx)
+        if resp.status_code != 200:
+            logger.error('ERROR: '+idx+' load status: '+str(resp.status_code)+' '+str(resp.content))
+            items = [(action, source, resp.status_code) for action, source in actions]
+            if resp.status_code in Bulk.RETRY_STATUS:
+                return (0, items, [])
+            return (0, [], items)
+
+        (accepted, retry, failed) = (0, [], [])
+        for (action, source), item in zip(actions, resp.json().get('items', [])):
+            result = list(item.values())[0]
+            error = result.get('error')
+            if error is None:
+                accepted += 1
+            elif (result.get('status') in Bulk.RETRY_STATUS or
+                  (isinstance(error, dict) and error.get('type') in Bulk.RETRY_ERRORS)):
+                retry.append((action, source, error))
+            else:
+                failed.append((action, source, error))
+        return (accepted, retry, failed)
+
+    @classmethod
+    def _write_dead_letter(cls, file_name, idx, idx_type, items):
+        ''' Append failed items to the dead letter file as bulk API data, adding
+        the index and type to each action so the file can be replayed. '''
+        lines = []
+        for action, source, error in items:
+            action_json = json.loads(action)
+            for meta in action_json.values():
+                meta.setdefault('_index', idx)
+                if idx_type != '':
+                    meta.setdefault('_type', idx_type)
+            lines.append(json.dumps(action_json) + '\n')
+            if source is not None:
+                lines.append(source + '\n')
+            logger.debug("Dead letter: "+action+" "+str(error))
+        with Bulk._dead_letter_lock:
+            with open(file_name, 'a') as f:
+                f.writelines(lines)
+
+    @classmethod
+    def replay(cls, file_name, chunk=1000, elastic_url=None):
+        ''' Reload the items in a dead letter file and return the number of
+        documents accepted and failed. Items that fail again are written to
+        a new dead letter file ([file_name].failed). '''
+        with open(file_name) as f:
+            actions = Bulk.split_actions(f.read())
+        dead_letter = file_name + '.failed'
+        (accepted, failed) = (0, 0)
+        for i in range(0, len(actions), chunk):
+            # group by index and type, these are in the action metadata
+            groups = {}
+            for action, source in actions[i:i+chunk]:
+                meta = list(json.loads(action).values())[0]
+                groups.setdefault((meta['_index'], meta.get('_type', '')), []).append((action, source))
+            for (idx, idx_type), group in groups.items():
+                json_data = ''.join(action + '\n' + (source + '\n' if source is not None else '')
+                                    for action, source in group)
+                (ok, bad) = Bulk.load_chunk(idx, idx_type, json_data, elastic_url=elastic_url,
+                                            dead_letter=dead_letter)
+                accepted += ok
+                failed += bad
+        return (accepted, failed)
+
+    @classmethod
+    def split_actions(cls, json_data):
+        ''' Return the (action, source) lines of bulk API data. The source
+        is None for delete actions. '''
+        actions = []
+        lines = iter(json_data.splitlines())
+        for line in lines:
+            if line.strip() == '':
+                continue
+            # all actions except delete are followed by a source line
+            source = None if 'delete' in json.loads(line) else next(lines, None)
+            actions.append((line, source))
+        return actions
+
+    @classmethod
+    def count_actions(cls, json_data):
+        ''' Return the number of actions in bulk API data. '''
+        return len(Bulk.split_actions(json_data))
+
 
 class ElasticQuery():
     ''' Takes a Query to be used to construct Elastic query which can be
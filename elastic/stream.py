@@ -0,0 +1,115 @@
+''' Incremental parsing of large JSON responses.
+
+A L{JsonStream} reads a JSON document from an iterable of byte chunks
+(I{e.g.} L{requests.Response.iter_content}) and yields the items of the
+array found at a path, such as the C{hits.hits} of a search response, as
+soon as each one has been read. Only the item being parsed is held in
+memory, so memory use does not grow with the size of the response. The
+other values met along the way (I{e.g.} C{took} and C{hits.total}) are
+kept in L{JsonStream.meta}.
+'''
+import codecs
+import json
+
+
+class JsonStream(object):
+    ''' Stream the items of an array in a JSON document. '''
+
+    def __init__(self, chunks, path=('hits', 'hits'), encoding='utf-8'):
+        ''' Set up the stream.
+        @type  chunks: iterable
+        @param chunks: Byte (or str) chunks of the JSON document.
+        @type  path: tuple
+        @keyword path: Keys of the objects leading to the array to stream.
+        @type  encoding: string
+        @keyword encoding: Encoding of the byte chunks (default: utf-8).
+        '''
+        self.path = tuple(path)
+        self.meta = {}
+        self._chunks = iter(chunks)
+        self._decoder = codecs.getincrementaldecoder(encoding)()
+        self._json = json.JSONDecoder()
+        self._buf = ''
+        self._pos = 0
+        self._eof = False
+
+    def __iter__(self):
+        if self._peek() != '{':
+            raise ValueError("JSON object expected")
+        return self._parse_object((), self.meta)
+
+    def _parse_object(self, path, meta):
+        ''' Parse an object, streaming the array if it is on the path. '''
+        self._pos += 1
+        while True:
+            c = self._peek()
+            if c == '}':
+                self._pos += 1
+                return
+            if c == ',':
+                self._pos += 1
+                continue
+            key = self._value()
+            if self._peek() != ':':
+                raise ValueError("':' expected at position " + str(self._pos))
+            self._pos += 1
+            key_path = path + (key,)
+            c = self._peek()
+            if key_path == self.path and c == '[':
+                yield from self._parse_array()
+            elif key_path == self.path[:len(key_path)] and c == '{':
+                meta[key] = {}
+                yield from self._parse_object(key_path, meta[key])
+            else:
+                meta[key] = self._value()
+
+    def _parse_array(self):
+        ''' Yield the items of an array. '''
+        self._pos += 1
+        while True:
+            c = self._peek()
+            if c == ']':
+                self._pos += 1
+                return
+            if c == ',':
+                self._pos += 1
+                continue
+            yield self._value()
+
+    def _value(self):
+        ''' Decode the value at the current position, reading more chunks
+        until it is complete. '''
+        while True:
+            self._peek()
+            try:
+                (value, end) = self._json.raw_decode(self._buf, self._pos)
+                # a number is only complete once the character after it has been read
+                if self._eof or (end < len(self._buf) and self._buf[end] not in '0123456789.eE+-'):
+                    self._pos = end
+                    return value
+            except ValueError:
+                if self._eof:
+                    raise
+            self._fill()
+
+    def _peek(self):
+        ''' Skip white space and return the next character. '''
+        while True:
+            while self._pos < len(self._buf) and self._buf[self._pos] in ' \t\n\r':
+                self._pos += 1
+            if self._pos < len(self._buf):
+                return self._buf[self._pos]
+            if self._eof:
+                raise ValueError("unexpected end of JSON")
+            self._fill()
+
+    def _fill(self):
+        ''' Drop the parsed text and read the next chunk. '''
+        self._buf = self._buf[self._pos:]
+        self._pos = 0
+        try:
+            chunk = next(self._chunks)
+            self._buf += self._decoder.decode(chunk) if isinstance(chunk, bytes) else chunk
+        except StopIteration:
+            self._buf += self._decoder.decode(b'', final=True)
+            self._eof = True
@@ -56,10 +56,8 @@ class ElasticResource(Resource):
         else:
             q = ElasticQuery(Query.match_all())
 
-        json_results = self._client(q).get_json_response()
         results = []
-
-        for result in json_results['hits']['hits']:
+        for result in self._client(q).iter_hits():
             new_obj = ElasticObject(initial=result['_source'])
             new_obj.uuid = result['_id']
             results.append(new_obj)
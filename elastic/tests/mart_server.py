@@ -0,0 +1,117 @@
+''' A local stand-in for a BioMart martservice, used to test and benchmark
+loading criteria without network access. The rows are generated from the
+attributes in the query and written in the JSON or TSV format requested, I{e.g.}::
+
+    with MartServer(rows=100000) as mart:
+        call_command('index_search', indexCriteria='true', martUrl=mart.url, ...)
+
+It can also be run on its own (python -m elastic.tests.mart_server [port] [rows]).
+'''
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from urllib.parse import unquote_plus
+import json
+import re
+import sys
+import threading
+
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class MartServer(object):
+    ''' Serve generated criteria rows for BioMart queries. '''
+
+    def __init__(self, rows=100, port=0):
+        ''' Set up the server.
+        @type  rows: integer
+        @keyword rows: Number of rows returned per query.
+        @type  port: integer
+        @keyword port: Port to listen on (default: any free port).
+        '''
+        self.rows = rows
+        self.queries = []
+        mart = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                mart._query(self)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = _ThreadingHTTPServer(('127.0.0.1', port), Handler)
+        self.url = 'http://127.0.0.1:' + str(self.server.server_address[1]) + '/biomart/martservice?'
+        self._thread = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def start(self):
+        self._thread = threading.Thread(target=self.server.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    @classmethod
+    def header(cls, attribute):
+        ''' Return the display name of a criteria attribute. '''
+        name = attribute.replace('criteria__object__main__', '')
+        names = {'primary_id': 'Primary id', 'name': 'Name', 'total_score': 'Total score',
+                 'object_class': 'Object class'}
+        if name in names:
+            return names[name]
+        if name.endswith('_flag'):
+            return name[:-len('_flag')].replace('_', ' ') + ' flag'
+        return name.replace('_', ' ') + ' score'
+
+    def _query(self, request):
+        query = unquote_plus(request.path.split('query=', 1)[-1])
+        self.queries.append(query)
+        processor = re.search(r'processor="(\w+)"', query).group(1)
+        dataset = re.search(r'Dataset name="(\w+)"', query).group(1)
+        headers = [MartServer.header(a) for a in re.findall(r'Attribute name="(\w+)"', query)]
+
+        request.send_response(200)
+        request.send_header('Content-Type', 'application/json' if processor == 'JSON' else 'text/plain')
+        request.end_headers()
+        if processor == 'JSON':
+            request.wfile.write(b'{"data": [')
+        else:
+            request.wfile.write(('\t'.join(headers) + '\n').encode('utf-8'))
+        for i in range(self.rows):
+            row = [self._value(dataset, header, i) for header in headers]
+            if processor == 'JSON':
+                line = (',' if i > 0 else '') + json.dumps(dict(zip(headers, row))) + '\n'
+            else:
+                line = '\t'.join(row) + '\n'
+            request.wfile.write(line.encode('utf-8'))
+        if processor == 'JSON':
+            request.wfile.write(b']}')
+
+    def _value(self, dataset, header, i):
+        if header == 'Primary id':
+            return dataset + '_' + str(i)
+        if header == 'Name':
+            return 'name' + str(i)
+        if header == 'Object class':
+            return dataset.split('_')[-1]
+        if header.endswith(' flag'):
+            return str(i % 2)
+        return str(i % 10)
+
+
+if __name__ == '__main__':
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else 8000
+    rows = int(sys.argv[2]) if len(sys.argv) > 2 else 100000
+    mart = MartServer(rows=rows, port=port)
+    print('BioMart stand-in serving ' + str(rows) + ' rows per query at ' + mart.url)
+    mart.server.serve_forever()
@@ -4,9 +4,12 @@ from django.core.management import call_command
 from elastic.tests.settings_idx import IDX, OVERRIDE_SETTINGS
 from elastic.elastic_settings import ElasticSettings
 from elastic.search import Bulk, Delete, ElasticQuery, Search, Update
+from elastic.transport import Transport
 from elastic.query import Query
 import requests
 import json
+import os
+import tempfile
 
 
 @override_settings(ELASTIC=OVERRIDE_SETTINGS)
@@ -37,6 +40,19 @@ class UpdateApiTest(TestCase):
         self.assertEquals(getattr(docs[0], 'start'), 100, "rs2476601 start")
         self.assertEquals(getattr(docs[0], 'end'), 200, "rs2476601 end")
 
+    def test_update_by_query(self):
+        ''' Set fields on the documents matching a query on the cluster. '''
+        idx = IDX['MARKER']['indexName']
+        query = ElasticQuery(Query.term("id", "rs2476601"))
+        updated = Update.update_by_query(idx, {"start": 300}, idx_type='marker', query=query, poll=1)
+        if ElasticSettings.version()['major'] < 5:
+            self.assertIsNone(updated, "not supported")
+            return
+        self.assertEquals(updated, 1)
+        Search.index_refresh(idx)
+        docs = Search(query, idx=idx).search().docs
+        self.assertEquals(getattr(docs[0], 'start'), 300, "rs2476601 start")
+
 
 @override_settings(ELASTIC=OVERRIDE_SETTINGS)
 class BulkApiTest(TestCase):
@@ -56,13 +72,18 @@ class BulkApiTest(TestCase):
         self.assertGreater(hits_total1, 0, "contains documents")
 
         # delete single doc
-        Delete.docs_by_query(idx, query=Query.term("id", "rs2476601"))
+        self.assertEquals(Delete.docs_by_query(idx, query=Query.term("id", "rs2476601")), 1)
         Search.index_refresh(idx)
         hits_total2 = elastic.get_count()['count']
         self.assertEquals(hits_total2, hits_total1-1, "contains documents")
 
+        # delete a doc on the cluster
+        self.assertEquals(Delete.docs_by_query(idx, query=Query.term("id", "rs768019142"), server_side=True, poll=1), 1)
+        Search.index_refresh(idx)
+        self.assertEquals(elastic.get_count()['count'], hits_total1-2, "contains documents")
+
         # delete remaining docs
-        Delete.docs_by_query(idx, 'marker')
+        self.assertEquals(Delete.docs_by_query(idx, 'marker', threads=3), hits_total1-2)
         Search.index_refresh(idx)
         self.assertEquals(elastic.get_count()['count'], 0, "contains no documents")
 
@@ -94,3 +115,49 @@ class BulkApiTest(TestCase):
         json_data += '{"doc": {"start": 100, "end": 200}}\n'
         resp = Bulk.load(idx, '', json_data)
         self.assertTrue('errors' in resp.json() and resp.json()['errors'])
+
+    def test_bulk_retry(self):
+        ''' Test only the rejected bulk items are resent, up to max_retries times. '''
+        class Response(object):
+            status_code = 200
+
+            def __init__(self, items):
+                self.items = items
+
+            def json(self):
+                return {"errors": True, "items": self.items}
+
+        rejected = {"index": {"status": 429, "error": {"type": "es_rejected_execution_exception"}}}
+        sent = []
+
+        def put(url, data=None, **kwargs):
+            actions = [json.loads(line)["index"]["_id"] for line in data.splitlines()[::2]]
+            sent.append(actions)
+            # the first document is accepted, the other two are always rejected
+            return Response([{"index": {"status": 201}} if _id == "1" else rejected for _id in actions])
+
+        json_data = ''.join('{"index": {"_id": "%d"}}\n{"id": "rs%d"}\n' % (i, i) for i in range(1, 4))
+        transport = Transport.get_transport()
+        transport.put = put
+        try:
+            with self.settings(ELASTIC={'default': dict(OVERRIDE_SETTINGS['default'], BULK_BACKOFF=0)}):
+                result = Bulk.load_chunk('test_retry', 'marker', json_data, max_retries=2)
+        finally:
+            del transport.put
+        self.assertEqual(result, (1, 2))
+        self.assertEqual(sent, [["1", "2", "3"], ["2", "3"], ["2", "3"]], "only rejected items resent")
+
+    def test_bulk_dead_letter(self):
+        ''' Test items that fail to load are written to the dead letter file. '''
+        self.set_up()
+        idx = IDX['MARKER']['indexName']
+        dead_letter = os.path.join(tempfile.mkdtemp(), 'dead_letter.json')
+        json_data = '{"update": {"_id": "XYZ"}}\n{"doc": {"start": 100}}\n'
+        json_data += '{"index": {"_id": "XYZ1"}}\n' + json.dumps({"id": "rsXYZ1", "seqid": "1"}) + '\n'
+        self.assertEqual(Bulk.load_chunk(idx, 'marker', json_data, dead_letter=dead_letter), (1, 1))
+
+        actions = Bulk.split_actions(open(dead_letter).read())
+        self.assertEqual(len(actions), 1)
+        self.assertEqual(json.loads(actions[0][0]), {"update": {"_id": "XYZ", "_index": idx, "_type": "marker"}})
+        self.assertEqual(Bulk.replay(dead_letter), (0, 1), 'document still missing')
+        self.assertTrue(os.path.exists(dead_letter + '.failed'))
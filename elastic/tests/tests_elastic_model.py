@@ -8,16 +8,22 @@ from elastic.tests.settings_idx import IDX, OVERRIDE_SETTINGS, SEARCH_SUFFIX
 from elastic.elastic_settings import ElasticSettings
 from django.core.urlresolvers import reverse
 from elastic.search import Search, ElasticQuery, Highlight, ScanAndScroll, Sort,\
-    Suggest, Bulk
+    Suggest, Bulk, MultiSearch
 from elastic.query import Query, BoolQuery, RangeQuery, Filter, TermsFilter,\
     AndFilter, NotFilter, OrFilter, ScoreFunction, FunctionScoreQuery, ExistsFilter
 from elastic.exceptions import AggregationError, QueryError
 from elastic.aggs import Agg, Aggs
+from elastic.cache import SearchCache
+from elastic.transport import Transport
+from elastic.stream import JsonStream
+from elastic.async_search import AsyncSearch, AsyncSuggest
 from rest_framework.test import APITestCase
+import asyncio
 import json
 import requests
 import time
 import sys
+import threading
 
 
 @override_settings(ELASTIC=OVERRIDE_SETTINGS)
@@ -165,6 +171,21 @@ class ScanAndScrollTest(TestCase):
         ScanAndScroll.scan_and_scroll(ElasticSettings.idx('DEFAULT'), call_fun=check_hits,
                                       query=ElasticQuery.query_string("rs2476601", fields=["id"]))
 
+    def test_iter_docs(self):
+        ''' Test iterating over the documents of an index with scan and scroll. '''
+        idx = ElasticSettings.idx('DEFAULT')
+        count = Search(idx=idx).get_count()['count']
+        doc_ids = [doc.doc_id() for doc in ScanAndScroll.iter_docs(idx)]
+        self.assertEqual(len(doc_ids), count)
+        self.assertEqual(len(set(doc_ids)), count, "No duplicate documents")
+        # falls back to a single slice before Elastic 5
+        doc_ids = [doc.doc_id() for doc in ScanAndScroll.iter_docs(idx, slices=2)]
+        self.assertEqual(len(set(doc_ids)), count)
+
+        pages = ScanAndScroll.iter_pages(idx, query=ElasticQuery(Query.match_all()))
+        self.assertGreaterEqual(len(next(pages)['hits']['hits']), 1)
+        pages.close()
+
 
 @override_settings(ELASTIC=OVERRIDE_SETTINGS)
 class SuggestTest(TestCase):
@@ -175,6 +196,22 @@ class SuggestTest(TestCase):
         self.assertTrue(resp[0]['options'][0]['text'], 'XAB')
 
 
+@override_settings(ELASTIC=OVERRIDE_SETTINGS)
+class AsyncSearchTest(TestCase):
+
+    def test_gather(self):
+        ''' Test independent searches awaited together. '''
+        query = ElasticQuery.query_string("rs2476601", fields=["id"])
+        searches = asyncio.gather(AsyncSearch(query, idx=ElasticSettings.idx('DEFAULT')).search(),
+                                  AsyncSearch(idx=ElasticSettings.idx('DEFAULT')).get_count(),
+                                  AsyncSuggest.suggest('XA', IDX['JSON_NESTED']['indexName'], name='suggest'))
+        (result, count, suggest) = asyncio.get_event_loop().run_until_complete(searches)
+        self.assertEqual(len(result.docs), 1, "Elastic string query retrieved marker (rs2476601)")
+        self.assertEqual(getattr(result.docs[0], 'id'), 'rs2476601')
+        self.assertGreater(count['count'], 1, "Elastic count documents in an index")
+        self.assertTrue('suggest' in suggest)
+
+
 @override_settings(ELASTIC=OVERRIDE_SETTINGS)
 class ElasticModelTest(TestCase):
 
@@ -482,6 +519,123 @@ class ElasticModelTest(TestCase):
         docs = elastic.search().docs
         self.assertTrue(len(docs) == 1, "Elastic string query retrieved marker (rs*)")
 
+    def test_multi_search(self):
+        ''' Test running searches in one multi search request. '''
+        searches = [Search(ElasticQuery.query_string("rs2476601", fields=["id"]), idx=ElasticSettings.idx('DEFAULT')),
+                    Search(ElasticQuery(Query.match_all()), idx="xyz123"),
+                    Search(ElasticQuery(Query.ids(['1', '2'])), idx=ElasticSettings.idx('DEFAULT'), size=1)]
+        results = MultiSearch(searches, max_searches=2).search()
+        self.assertEqual(len(results), 3)
+        self.assertEqual(getattr(results[0].docs[0], 'id'), 'rs2476601')
+        self.assertTrue(results[1].error is not None, "Missing index error")
+        self.assertEqual(len(results[1].docs), 0)
+        self.assertEqual(results[2].hits_total, 2)
+        self.assertEqual(len(results[2].docs), 1)
+        self.assertRaises(QueryError, MultiSearch, ['xyz123'])
+
+    def test_search_cache(self):
+        ''' Test search responses are cached when a cache is configured. '''
+        cache_settings = {'default': dict(OVERRIDE_SETTINGS['default'], CACHE={'MAX_SIZE': 1, 'TTL': 60})}
+        with self.settings(ELASTIC=cache_settings):
+            cache = SearchCache.get_cache()
+            cache.clear()
+            query = ElasticQuery.query_string("rs2476601", fields=["id"])
+            docs1 = Search(query, idx=ElasticSettings.idx('DEFAULT')).search().docs
+            docs2 = Search(query, idx=ElasticSettings.idx('DEFAULT')).search().docs
+            self.assertEqual(cache.stats()['hits'], 1)
+            self.assertEqual(docs1[0].doc_id(), docs2[0].doc_id())
+            Search(query, idx=ElasticSettings.idx('DEFAULT'), size=1).search()
+            self.assertEqual(cache.stats()['misses'], 2)
+            self.assertEqual(cache.stats()['size'], 1, "LRU bounded to MAX_SIZE")
+        self.assertTrue(SearchCache.get_cache() is None, "Cache is opt-in")
+
+    def test_search_cache_invalidate(self):
+        ''' Test writes to an index invalidate just the cached responses for that index. '''
+        cache_settings = {'default': dict(OVERRIDE_SETTINGS['default'], CACHE={'MAX_SIZE': 10, 'TTL': 60})}
+        with self.settings(ELASTIC=cache_settings):
+            cache = SearchCache.get_cache()
+            cache.clear()
+            query = ElasticQuery(Query.match_all())
+            marker_search = Search(query, idx=ElasticSettings.idx('DEFAULT'))
+            gff_search = Search(query, idx=IDX['GFF_GENERIC']['indexName'])
+            marker_key = cache.search_key(marker_search)
+            gff_key = cache.search_key(gff_search)
+            marker_search.search()
+            gff_search.search()
+
+            Search.index_refresh(ElasticSettings.idx('DEFAULT'))
+            self.assertNotEqual(marker_key, cache.search_key(marker_search), "Generation bumped")
+            self.assertEqual(gff_key, cache.search_key(gff_search), "Generation unchanged")
+            marker_search.search()
+            gff_search.search()
+            self.assertEqual(cache.stats()['hits'], 1)
+
+            # writes to an index invalidate searches made through its aliases
+            alias = ElasticSettings.idx('DEFAULT') + '_cache_alias'
+            requests.post(ElasticSettings.url() + '/_aliases', data=json.dumps(
+                {"actions": [{"add": {"index": ElasticSettings.idx('DEFAULT'), "alias": alias}}]}))
+            alias_search = Search(query, idx=alias)
+            alias_key = cache.search_key(alias_search)
+            SearchCache.invalidate(ElasticSettings.idx('DEFAULT'))
+            self.assertNotEqual(alias_key, cache.search_key(alias_search), "Alias generation bumped")
+            requests.post(ElasticSettings.url() + '/_aliases', data=json.dumps(
+                {"actions": [{"remove": {"index": ElasticSettings.idx('DEFAULT'), "alias": alias}}]}))
+
+    def test_coalesce_searches(self):
+        ''' Test identical concurrent searches share one in flight request. '''
+        query = ElasticQuery(Query.match_all())
+        transport = Transport.get_transport()
+        single_flight = transport.single_flight
+        calls = single_flight.calls
+        coalesced = single_flight.coalesced
+        n_searches = 10
+        barrier = threading.Barrier(n_searches)
+        sent = []
+        request = transport.request
+
+        def slow_request(method, url, **kwargs):
+            # hold the leader's request until every search has joined it
+            sent.append(url)
+            end = time.time() + 10
+            while single_flight.calls - calls < n_searches and time.time() < end:
+                time.sleep(0.01)
+            return request(method, url, **kwargs)
+
+        def search():
+            barrier.wait()
+            results.append(Search(query, idx=ElasticSettings.idx('DEFAULT')).search().hits_total)
+
+        results = []
+        threads = [threading.Thread(target=search) for _ in range(n_searches)]
+        transport.request = slow_request
+        try:
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+        finally:
+            del transport.request
+        self.assertEqual(len(results), n_searches)
+        self.assertEqual(len(set(results)), 1, "Same result for all searches")
+        self.assertEqual(single_flight.calls - calls, n_searches)
+        self.assertEqual(single_flight.coalesced - coalesced, n_searches - 1, "Searches coalesced")
+        self.assertEqual(len(sent), 1, "One request sent for all searches")
+
+    def test_iter_docs(self):
+        ''' Test streaming the search hits. '''
+        query = ElasticQuery(Query.match_all())
+        elastic = Search(query, idx=ElasticSettings.idx('DEFAULT'), size=100)
+        docs = elastic.search().docs
+        streamed = list(elastic.iter_docs(chunk_size=64))
+        self.assertEqual(len(docs), len(streamed))
+        self.assertEqual([d.doc_id() for d in docs], [d.doc_id() for d in streamed])
+
+        resp = json.dumps({"took": 2, "hits": {"total": 2, "max_score": 1.0,
+                                               "hits": [{"_id": "1", "_source": {"id": "rs1"}}, {"_id": "2"}]}})
+        stream = JsonStream([resp[i:i+3].encode('utf-8') for i in range(0, len(resp), 3)])
+        self.assertEqual([hit['_id'] for hit in stream], ['1', '2'])
+        self.assertEqual(stream.meta['hits']['total'], 2)
+
     def test_count(self):
         ''' Test count the number of documents in an index. '''
         elastic = Search(idx=ElasticSettings.idx('DEFAULT'))
@@ -1,11 +1,13 @@
 from django.test import TestCase
 from elastic.elastic_settings import ElasticSettings, ElasticUrl
+from elastic.node_pool import NodePool
 from elastic.exceptions import SettingsError
 from django.test.utils import override_settings
 from elastic.tests.settings_idx import OVERRIDE_SETTINGS, OVERRIDE_SETTINGS2, OVERRIDE_SETTINGS3,\
     IDX
 from django.core.management import call_command
 from elastic.search import Search, ElasticQuery
+from elastic.transport import Transport
 import requests
 from elastic.query import Query, Filter
 import json
@@ -63,4 +65,44 @@ class ElasticSettingsTest(TestCase):
         elastic = Search(query, idx=ElasticSettings.idx('DEFAULT'))
         self.assertTrue(elastic.search().hits_total == 1, "Elastic filtered query retrieved marker")
         Search.index_exists('test', 'test2')
-        ElasticUrl.URL_INDEX = 0  # reset
+        pool = ElasticUrl.get_pool()
+        self.assertFalse(pool.nodes[0].is_alive(), "Unreachable node out of rotation")
+        self.assertTrue(pool.nodes[1].is_alive(), "Reachable node in rotation")
+        NodePool.reset()
+
+    def test_node_pool(self):
+        ''' Test node selection and cooldown of failing nodes. '''
+        urls = ['http://node1:9200/', 'http://node2:9200/']
+        pool = NodePool(urls, max_failures=2, probe_interval=60)
+        self.assertEqual([pool.select(), pool.select(), pool.select()], [urls[0], urls[1], urls[0]])
+        node = pool.node_for(urls[1] + '_search')
+        self.assertEqual(node.url, urls[1])
+        pool.mark_failure(node)
+        self.assertTrue(node.is_alive(), "Node in rotation after one failure")
+        pool.mark_failure(node)
+        self.assertFalse(node.is_alive(), "Node out of rotation after two failures")
+        self.assertEqual(set([pool.select() for _ in range(4)]), set([urls[0]]))
+        pool.revive(node)
+        self.assertTrue(node.is_alive(), "Node back in rotation")
+
+        pool = NodePool(urls, selector=NodePool.LEAST_LATENCY)
+        pool.mark_success(pool.nodes[0], 0.5)
+        pool.mark_success(pool.nodes[1], 0.01)
+        self.assertEqual(set([pool.select() for _ in range(4)]), set([urls[1]]))
+        self.assertRaises(ValueError, NodePool, urls, selector='xyz')
+
+    @override_settings(ELASTIC=OVERRIDE_SETTINGS)
+    def test_transport(self):
+        ''' Test the pooled transport is shared and follows the pool settings. '''
+        transport = Transport.get_transport()
+        self.assertTrue(transport is Transport.get_transport(), "Transport shared between requests")
+        self.assertEqual(transport.pool_size, Transport.POOL_SIZE)
+        resp = transport.get(ElasticSettings.url() + '/_cluster/health/')
+        self.assertEqual(resp.status_code, 200, "Health page status code")
+
+        pooled_settings = {'default': dict(OVERRIDE_SETTINGS['default'], POOL_SIZE=2, KEEP_ALIVE=False)}
+        with self.settings(ELASTIC=pooled_settings):
+            pooled = Transport.get_transport()
+            self.assertFalse(pooled is transport, "New transport for new pool settings")
+            self.assertEqual(pooled.pool_size, 2)
+            self.assertEqual(pooled.session.headers['Connection'], 'close')
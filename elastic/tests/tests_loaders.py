@@ -1,18 +1,31 @@
 ''' Tests for command line interface for managing Elastic repositories,
 defining mappings for indices and loading/indexing data. '''
 from django.test import TestCase
-from django.core.management import call_command
-from elastic.tests.settings_idx import IDX, IDX_UPDATE
+from django.core.management import call_command, CommandError
+from elastic.tests.settings_idx import IDX, IDX_UPDATE, SEARCH_SUFFIX
 import requests
 from elastic.management.loaders.utils import GFF, GFFError
 from elastic.elastic_settings import ElasticSettings
 from elastic.management.snapshot import Snapshot
-from elastic.search import Search
+from elastic.management.reindex import Reindex
+from elastic.search import Search, Bulk, ElasticQuery
+from elastic.query import Query
+from elastic.bulk import BulkBuffer, BulkIndexer
+import json
+import os
+import tempfile
+import threading
 import time
 import logging
-from elastic.management.loaders.loader import Loader
+from elastic.management.loaders.loader import Loader, JSONLoader, DelimeterLoader
 from elastic.management.loaders.exceptions import LoaderError, MappingError
 from elastic.management.loaders.mapping import MappingProperties
+from elastic.management.loaders.checkpoint import Checkpoint
+from elastic.management.loaders.gene import GeneManager
+from elastic.management.loaders.criteria import CriteriaManager
+from elastic.management.loaders.alias import AliasManager
+from elastic.management.loaders.update import UpdateManager
+from elastic.tests.mart_server import MartServer
 
 # Get an instance of a logger
 logger = logging.getLogger(__name__)
@@ -123,6 +136,289 @@ class ElasticLoadersTest(TestCase):
         seqid = mapping_json[idx]['mappings']['gff']['properties']['seqid']
         self.assertTrue('not_analyzed' == seqid['index'], 'seqid in GFF is not_analyzed')
 
+    def test_bulk_indexer(self):
+        ''' Test loading with several bulk sender threads. '''
+        idx = 'test__bulk_indexer_'+SEARCH_SUFFIX
+        loader = JSONLoader(bulkThreads=3, bulkQueue=2)
+        docs = [{"_id": str(i), "name": "doc"+str(i)} for i in range(12000)]
+        loader.load(docs, idx, 'doc')
+        self.assertEqual(loader.bulk_stats['accepted'], 12000)
+        self.assertEqual(loader.bulk_stats['failed'], 0)
+        self.assertEqual(loader.bulk_stats['chunks'], 3)
+        Search.index_refresh(idx)
+        self.assertEqual(Search(idx=idx).get_count()['count'], 12000)
+
+        # a failing callback does not stop the senders and is raised by close
+        def callback(accepted, failed):
+            raise OSError("disk full")
+        indexer = BulkIndexer(idx, 'doc', threads=2, queue_size=1)
+        for i in range(6):
+            try:
+                indexer.add(json.dumps({"index": {"_id": str(i)}}) + '\n{"name": "doc"}\n', callback=callback)
+            except OSError:
+                break
+        self.assertRaises(OSError, indexer.close)
+        requests.delete(ElasticSettings.url() + '/' + idx)
+
+    def test_parallel_parse(self):
+        ''' Test parsing a file with a pool of processes loads the same documents. '''
+        idx_kwargs = dict(IDX['GFF_GENERIC'])
+        idx = idx_kwargs['indexName'] + '_parallel'
+        idx_kwargs.update({'indexName': idx, 'processes': 2})
+        call_command('index_search', **idx_kwargs)
+        Search.index_refresh(idx)
+        gff_idx = IDX['GFF_GENERIC']['indexName']
+        self.assertEqual(Search(idx=idx).get_count()['count'], Search(idx=gff_idx).get_count()['count'])
+        doc = Search(idx=idx, size=1).search().docs[0]
+        same_doc = Search(ElasticQuery(Query.ids([doc.doc_id()])), idx=gff_idx).search().docs[0]
+        self.assertEqual(doc.seqid, same_doc.seqid)
+        self.assertEqual(doc.start, same_doc.start)
+        requests.delete(ElasticSettings.url() + '/' + idx)
+
+    def test_fast_ingest(self):
+        ''' Test the index settings are restored after a fast ingest. '''
+        idx_kwargs = dict(IDX['BED_GENERIC'])
+        idx = idx_kwargs['indexName'] + '_fast'
+        idx_kwargs.update({'indexName': idx, 'fastIngest': True, 'maxSegments': 1})
+        call_command('index_search', **idx_kwargs)
+        resp = requests.get(ElasticSettings.url() + '/' + idx + '/_settings')
+        idx_settings = resp.json()[idx]['settings']['index']
+        self.assertNotEqual(idx_settings.get('refresh_interval'), '-1', 'refresh interval restored')
+        self.assertNotEqual(idx_settings.get('number_of_replicas'), '0', 'replicas restored')
+        self.assertEqual(Search(idx=idx).get_count()['count'],
+                         Search(idx=IDX['BED_GENERIC']['indexName']).get_count()['count'])
+
+        # the indices an alias points at are tuned
+        alias = idx + '_alias'
+        requests.post(ElasticSettings.url() + '/_aliases',
+                      data=json.dumps({"actions": [{"add": {"index": idx, "alias": alias}}]}))
+        loader = Loader()
+        loader.start_ingest(alias)
+        resp = requests.get(ElasticSettings.url() + '/' + idx + '/_settings')
+        self.assertEqual(resp.json()[idx]['settings']['index'].get('refresh_interval'), '-1')
+        loader.finish_ingest()
+        resp = requests.get(ElasticSettings.url() + '/' + idx + '/_settings')
+        self.assertNotEqual(resp.json()[idx]['settings']['index'].get('refresh_interval'), '-1')
+        requests.delete(ElasticSettings.url() + '/' + idx)
+
+    def test_resume(self):
+        ''' Test a load resumes after the lines recorded in its checkpoint. '''
+        idx_kwargs = dict(IDX['BED_GENERIC'])
+        idx = idx_kwargs['indexName'] + '_resume'
+        checkpoint_file = os.path.join(tempfile.mkdtemp(), 'test.checkpoint')
+        checkpoint = Checkpoint(checkpoint_file, idx, idx_kwargs['indexType'])
+        # chunks acknowledged out of order only advance the checkpoint once contiguous
+        chunks = [checkpoint.sent(1, 1), checkpoint.sent(2, 2)]
+        checkpoint.acknowledged(chunks[1])
+        self.assertFalse(os.path.exists(checkpoint_file))
+        checkpoint.acknowledged(chunks[0])
+        self.assertEqual(checkpoint.position(), (2, 2))
+        # a chunk with failed documents is recorded and the checkpoint carries on
+        failed = Checkpoint(checkpoint_file + '.failed', idx, idx_kwargs['indexType'])
+        chunks = [failed.sent(5, 5), failed.sent(9, 9)]
+        failed.acknowledged(chunks[0], ok=False)
+        failed.acknowledged(chunks[1])
+        self.assertEqual(failed.position(), (9, 9))
+        self.assertEqual(failed.failed, [[1, 5]])
+        failed.remove()
+        self.assertTrue(os.path.exists(checkpoint_file + '.failed'), 'checkpoint with failed lines kept')
+
+        idx_kwargs.update({'indexName': idx, 'resume': True, 'checkpoint': checkpoint_file})
+        call_command('index_search', **idx_kwargs)
+        Search.index_refresh(idx)
+        self.assertFalse(os.path.exists(checkpoint_file), 'checkpoint removed after the load')
+        self.assertEqual(Search(idx=idx).get_count()['count'] + 2,
+                         Search(idx=IDX['BED_GENERIC']['indexName']).get_count()['count'])
+        self.assertEqual(Search(ElasticQuery(Query.ids(['1', '2'])), idx=idx).get_count()['count'], 0)
+        requests.delete(ElasticSettings.url() + '/' + idx)
+
+    def test_reindex(self):
+        ''' Test reindexing loads a new index version and moves the alias to it. '''
+        idx_kwargs = dict(IDX['BED_GENERIC'])
+        alias = idx_kwargs['indexName'] + '_alias'
+        idx_kwargs.update({'indexName': alias, 'reindex': True})
+        call_command('index_search', **idx_kwargs)
+        first = Reindex.aliases(alias)
+        self.assertEqual(len(first), 1)
+        self.assertEqual(Search(idx=alias).get_count()['count'],
+                         Search(idx=IDX['BED_GENERIC']['indexName']).get_count()['count'])
+
+        idx_kwargs.update({'indexName': alias, 'keepGenerations': 0})
+        call_command('index_search', **idx_kwargs)
+        second = Reindex.aliases(alias)
+        self.assertNotEqual(first, second, 'alias moved to the new index')
+        self.assertEqual(list(Reindex.generations(alias).keys()), second, 'old index deleted')
+
+        idx_kwargs.update({'indexName': alias, 'minDocs': 1000000})
+        self.assertRaises(LoaderError, call_command, 'index_search', **idx_kwargs)
+        self.assertEqual(Reindex.aliases(alias), second, 'alias not moved to an incomplete index')
+        self.assertEqual(list(Reindex.generations(alias).keys()), second, 'incomplete index deleted')
+        self.assertTrue(Reindex.generation_key(alias, alias+'_v20160101_10') >
+                        Reindex.generation_key(alias, alias+'_v20160101_2') >
+                        Reindex.generation_key(alias, alias+'_v20160101'), 'versions ordered by number')
+        self.assertIsNone(Reindex.generation_key(alias, alias+'_vcf_v20160101'))
+        idx_kwargs.update({'indexName': alias, 'minDocs': 1, 'resume': True})
+        self.assertRaises(CommandError, call_command, 'index_search', **idx_kwargs)
+        for idx in Reindex.generations(alias):
+            requests.delete(ElasticSettings.url() + '/' + idx)
+
+    def test_gene_lookup(self):
+        ''' Test genes are resolved the same way from multi searches and the preloaded index. '''
+        idx = IDX['GENE']['indexName']
+        names = [doc.gene_symbol for doc in Search(idx=idx, size=10).search().docs] + ['XYZ_NOT_A_GENE']
+        loader = GeneManager()
+        genes = loader._msearch_lookup(idx, names)
+        self.assertTrue(len(genes) > 0)
+        self.assertNotIn('XYZ_NOT_A_GENE', genes)
+        preloaded = loader._preload_lookup(idx)(names)
+        self.assertEqual({name: gdata['idx_id'] for name, gdata in genes.items()},
+                         {name: gdata['idx_id'] for name, gdata in preloaded.items()})
+
+    def test_ndjson(self):
+        ''' Test loading a file with a JSON document per line. '''
+        idx = IDX['JSON']['indexName'] + '_ndjson'
+        ndjson_file = os.path.join(tempfile.mkdtemp(), 'docs.ndjson')
+        with open(ndjson_file, 'w') as f:
+            for i in range(10):
+                f.write(json.dumps({"_id": str(i), "title": "title "+str(i)}) + '\n')
+        call_command('index_search', indexName=idx, indexType='publication', indexJson=ndjson_file)
+        Search.index_refresh(idx)
+        self.assertEqual(Search(idx=idx).get_count()['count'], 10)
+        requests.delete(ElasticSettings.url() + '/' + idx)
+
+    def test_criteria_mart(self):
+        ''' Test criteria rows are streamed from BioMart in JSON and TSV. '''
+        idx_kwargs = dict(IDX['T1D_CRITERIA'])
+        idx = idx_kwargs['indexName'] + '_mart'
+        for processor in CriteriaManager.MART_PROCESSORS:
+            with MartServer(rows=50) as mart:
+                idx_kwargs.update({'indexName': idx, 'applyFilter': None, 'martUrl': mart.url,
+                                   'martProcessor': processor})
+                call_command('index_search', **idx_kwargs)
+                self.assertEqual(len(mart.queries), 4, 'one query per index type')
+            Search.index_refresh(idx)
+            self.assertEqual(Search(idx=idx, idx_type='gene').get_count()['count'], 50)
+            doc = Search(idx=idx, idx_type='marker', size=1).search().docs[0]
+            self.assertTrue(getattr(doc, 'Primary id').startswith('t1dbase_criteria_markers_'))
+            requests.delete(ElasticSettings.url() + '/' + idx)
+
+    def test_alias_concurrency(self):
+        ''' Test alias files loaded concurrently give the same documents. '''
+        idx_kwargs = dict(IDX['GENE_ALIAS'])
+        idx = idx_kwargs['indexName'] + '_concurrent'
+        idx_kwargs.update({'indexName': idx, 'indexType': None})
+        stats = AliasManager(concurrency=3).create_alias(concurrency=3, **idx_kwargs)
+        self.assertEqual(len(stats), 3, 'human, mouse and rat files loaded')
+        Search.index_refresh(idx)
+        self.assertEqual(Search(idx=idx).get_count()['count'], sum(ndocs for _f, ndocs, _secs in stats))
+        self.assertEqual(Search(idx=idx).get_count()['count'],
+                         Search(idx=IDX['GENE_ALIAS']['indexName']).get_count()['count'])
+        requests.delete(ElasticSettings.url() + '/' + idx)
+
+    def test_update_idx(self):
+        ''' Test updating all the documents of an index with a partial document. '''
+        idx_kwargs = dict(IDX['BED_GENERIC'])
+        idx = idx_kwargs['indexName'] + '_update'
+        idx_kwargs.update({'indexName': idx})
+        call_command('index_search', **idx_kwargs)
+        Search.index_refresh(idx)
+        json_file = os.path.join(tempfile.mkdtemp(), 'update.json')
+        with open(json_file, 'w') as f:
+            f.write(json.dumps({"doc": {"flag": "updated"}}))
+        stats = UpdateManager(bulkDocs=2).update_idx(indexName=idx, indexType=idx_kwargs['indexType'],
+                                                     json_data=json_file, random_update=None)
+        count = Search(idx=idx).get_count()['count']
+        self.assertEqual(stats['accepted'], count)
+        self.assertEqual(stats['failed'], 0)
+        Search.index_refresh(idx)
+        query = ElasticQuery(Query.term("flag", "updated"))
+        self.assertEqual(Search(query, idx=idx).get_count()['count'], count)
+        requests.delete(ElasticSettings.url() + '/' + idx)
+
+    def test_update_idx_concurrent(self):
+        ''' Test updates of different indices running at the same time. '''
+        idx_kwargs = dict(IDX['BED_GENERIC'])
+        idx_names = [idx_kwargs['indexName'] + '_update' + str(i) for i in range(2)]
+        for idx in idx_names:
+            call_command('index_search', **dict(idx_kwargs, indexName=idx))
+            Search.index_refresh(idx)
+        json_file = os.path.join(tempfile.mkdtemp(), 'update.json')
+        with open(json_file, 'w') as f:
+            f.write(json.dumps({"doc": {"flag": "updated"}}))
+
+        stats = {}
+
+        def update(idx):
+            stats[idx] = UpdateManager(bulkDocs=2).update_idx(indexName=idx, indexType=idx_kwargs['indexType'],
+                                                              json_data=json_file, random_update=None)
+        threads = [threading.Thread(target=update, args=(idx,)) for idx in idx_names]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        query = ElasticQuery(Query.term("flag", "updated"))
+        for idx in idx_names:
+            count = Search(idx=idx).get_count()['count']
+            self.assertEqual(stats[idx]['accepted'], count, idx)
+            self.assertEqual(stats[idx]['failed'], 0, idx)
+            Search.index_refresh(idx)
+            self.assertEqual(Search(query, idx=idx).get_count()['count'], count, idx)
+            requests.delete(ElasticSettings.url() + '/' + idx)
+
+    def test_column_plan(self):
+        ''' Test the column converters are chosen from the mapping types. '''
+        loader = DelimeterLoader()
+        props = MappingProperties('test')
+        props.add_property("seqid", "string") \
+             .add_property("start", "integer") \
+             .add_property("score", "float") \
+             .add_property("date", "date")
+        loader.mapping_json = props.mapping_properties
+        column_names = props.get_column_names() + ["attr"]
+        doc = loader.parse_line(['chr1', '-10', '0.5', '2015-01-01', 'Name=rs1;region_id=36'], column_names,
+                                'test_idx', 'test', True, False)
+        self.assertEqual(doc, {"seqid": "chr1", "start": -10, "score": 0.5, "date": "2015-01-01",
+                               "attr": {"Name": "rs1", "region_id": "36"}})
+        doc = loader.parse_line(['A::B', '.', 'x', '2015', '12'], column_names, 'test_idx', 'test', False, False)
+        self.assertEqual(doc, {"seqid": ["A", "B"], "start": ".", "score": "x", "date": "2015", "attr": "12"})
+        self.assertIs(loader.column_plan(column_names, 'test_idx', 'test'),
+                      loader.column_plan(column_names, 'test_idx', 'test'), "plan compiled once")
+        loader = DelimeterLoader()
+        loader.SPLIT_LISTS = False
+        loader.mapping_json = props.mapping_properties
+        doc = loader.parse_line(['A::B', '1', '1', '2015', '12'], column_names, 'test_idx', 'test', False, False)
+        self.assertEqual(doc["seqid"], "A::B")
+
+        # mapped number columns are loaded as numbers, unmapped columns as strings
+        loader = DelimeterLoader()
+        props = MappingProperties('test')
+        for map_type in ('integer', 'long', 'short', 'byte', 'float', 'double'):
+            props.add_property(map_type, map_type)
+        loader.mapping_json = props.mapping_properties
+        column_names = props.get_column_names() + ["unmapped"]
+        doc = loader.parse_line(['1', '2', '3', '4', '0.5', '6', '7'], column_names, 'test_idx', 'test', False, False)
+        self.assertEqual(doc, {"integer": 1, "long": 2, "short": 3, "byte": 4, "float": 0.5, "double": 6.0,
+                               "unmapped": "7"})
+        self.assertIsInstance(doc["double"], float)
+
+    def test_bulk_buffer(self):
+        ''' Test bulk requests are sent on size or number of documents. '''
+        requests_data = []
+        with BulkBuffer(requests_data.append, max_bytes=100, max_docs=3) as buf:
+            for i in range(4):
+                buf.add({"index": {"_id": str(i)}}, {"name": "x"})
+        self.assertEqual(len(requests_data), 2, "flushed on number of documents")
+        self.assertEqual(Bulk.count_actions(requests_data[0]), 3)
+
+        requests_data = []
+        with BulkBuffer(requests_data.append, max_bytes=100, max_docs=1000) as buf:
+            for i in range(10):
+                buf.add({"index": {"_id": str(i)}}, {"name": "x"*20})
+        self.assertEqual(buf.docs, 10)
+        self.assertTrue(len(requests_data) > 1, "flushed on size")
+        self.assertTrue(all(len(data) < 200 for data in requests_data))
+
     def test_mapping_error(self):
         self.assertRaises(LoaderError, Loader().mapping, 'MappingProperties', '')
         self.assertRaises(MappingError, MappingProperties('').add_properties, 'MappingProperties')
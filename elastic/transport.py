@@ -0,0 +1,228 @@
+''' Pooled HTTP transport used for all requests made to an Elastic cluster.
+
+A L{Transport} wraps a L{requests.Session} so that the connections to
+the Elastic nodes are kept alive and reused across searches, bulk loads
+and snapshot calls rather than opening a new TCP connection per request.
+Request latencies and failures are reported to the cluster L{NodePool}
+so that sick nodes are taken out of rotation.
+
+One transport is shared per cluster and can be configured in the ELASTIC
+settings I{e.g.}::
+
+    ELASTIC = {
+        'default': {
+            'ELASTIC_URL': 'http://127.0.0.1:9200/',
+            'POOL_SIZE': 20,      # connections kept open per node
+            'KEEP_ALIVE': True,   # reuse connections between requests
+            'TIMEOUT': 60,        # request timeout in seconds
+            'COALESCE_SEARCHES': True,  # share responses of identical concurrent searches
+        }
+    }
+'''
+import threading
+import time
+import logging
+import requests
+from requests.packages.urllib3.exceptions import ConnectTimeoutError
+from requests.adapters import HTTPAdapter
+from elastic.elastic_settings import ElasticSettings, ElasticUrl
+
+# Get an instance of a logger
+logger = logging.getLogger(__name__)
+
+
+class Transport(object):
+    ''' Keep-alive connection pool for requests to an Elastic cluster. '''
+
+    POOL_SIZE = 10
+    # methods that can be sent again to another node if the connection fails
+    IDEMPOTENT = ('GET', 'HEAD', 'OPTIONS', 'DELETE')
+    TRANSPORTS = {}
+    _lock = threading.Lock()
+
+    def __init__(self, pool_size=POOL_SIZE, pool_connections=POOL_SIZE, keep_alive=True, timeout=None,
+                 cluster='default'):
+        ''' Set up the connection pool.
+        @type  pool_size: integer
+        @keyword pool_size: Maximum number of connections kept per node.
+        @type  pool_connections: integer
+        @keyword pool_connections: Number of node connection pools to cache.
+        @type  keep_alive: bool
+        @keyword keep_alive: Reuse connections between requests (default: True).
+        @type  timeout: float
+        @keyword timeout: Default request timeout in seconds (default: None).
+        @type  cluster: string
+        @keyword cluster: Elastic cluster the requests are made to (default: 'default').
+        '''
+        self.cluster = cluster
+        self.pool_size = pool_size
+        self.keep_alive = keep_alive
+        self.timeout = timeout
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        if not keep_alive:
+            self.session.headers['Connection'] = 'close'
+        self.single_flight = SingleFlight()
+
+    @classmethod
+    def get_transport(cls, cluster='default'):
+        ''' Return the shared transport for a cluster, creating it from the
+        cluster settings on first use. '''
+        pool_size = ElasticSettings.getattr('POOL_SIZE', cluster=cluster, default=Transport.POOL_SIZE)
+        keep_alive = ElasticSettings.getattr('KEEP_ALIVE', cluster=cluster, default=True)
+        timeout = ElasticSettings.getattr('TIMEOUT', cluster=cluster)
+        key = (cluster, pool_size, keep_alive, timeout)
+        transport = Transport.TRANSPORTS.get(key)
+        if transport is None:
+            with Transport._lock:
+                transport = Transport.TRANSPORTS.get(key)
+                if transport is None:
+                    urls = ElasticSettings.getattr('ELASTIC_URL', cluster=cluster)
+                    nodes = 1 if isinstance(urls, str) else max(len(urls), 1)
+                    transport = cls(pool_size=pool_size, pool_connections=max(nodes, Transport.POOL_SIZE),
+                                    keep_alive=keep_alive, timeout=timeout, cluster=cluster)
+                    Transport.TRANSPORTS[key] = transport
+                    logger.debug("Transport created for cluster "+cluster+" (pool size "+str(pool_size)+")")
+        return transport
+
+    @classmethod
+    def close_all(cls):
+        ''' Close the connection pools of all transports. '''
+        with Transport._lock:
+            for transport in Transport.TRANSPORTS.values():
+                transport.close()
+            Transport.TRANSPORTS = {}
+
+    def request(self, method, url, data=None, **kwargs):
+        ''' Make a request using a pooled connection and return the response.
+        If the node cannot be reached the request is retried on the other
+        healthy nodes of the cluster. Requests that are not idempotent (I{e.g.}
+        bulk loads) are only retried if the connection failed before the
+        request was sent, so that they cannot be applied twice. '''
+        kwargs.setdefault('timeout', self.timeout)
+        pool = ElasticUrl.get_pool(cluster=self.cluster)
+        tried = []
+        while True:
+            node = pool.node_for(url)
+            start = time.time()
+            try:
+                resp = self.session.request(method, url, data=data, **kwargs)
+            except requests.exceptions.ConnectionError as e:
+                if node is None:
+                    raise
+                logger.error('ConnectionError ' + node.url)
+                pool.mark_failure(node)
+                if method.upper() not in Transport.IDEMPOTENT and not _not_sent(e):
+                    raise
+                tried.append(node.url)
+                next_url = pool.select(exclude=tried)
+                if next_url is None:
+                    raise
+                url = next_url.rstrip('/') + url[len(node.base_url):]
+                continue
+            except requests.exceptions.Timeout:
+                if node is not None:
+                    pool.mark_failure(node)
+                raise
+
+            if node is not None:
+                if resp.status_code in (502, 503, 504):
+                    pool.mark_failure(node)
+                else:
+                    pool.mark_success(node, time.time() - start)
+            return resp
+
+    def coalesced_request(self, method, url, data=None):
+        ''' Make a request, sharing the response with identical requests (same
+        method, URL and body) that are already in flight. Only to be used for
+        requests that do not modify the index, I{e.g.} searches. '''
+        def request():
+            resp = self.request(method, url, data=data)
+            resp.content  # read the body before the response is shared
+            return resp
+        # form data (e.g. an empty dict) is not hashable
+        key = data if data is None or isinstance(data, (str, bytes)) else repr(data)
+        return self.single_flight.do((method, url, key), request)
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url, data=None, **kwargs):
+        return self.request('POST', url, data=data, **kwargs)
+
+    def put(self, url, data=None, **kwargs):
+        return self.request('PUT', url, data=data, **kwargs)
+
+    def delete(self, url, data=None, **kwargs):
+        return self.request('DELETE', url, data=data, **kwargs)
+
+    def head(self, url, **kwargs):
+        return self.request('HEAD', url, **kwargs)
+
+    def close(self):
+        ''' Close all pooled connections. '''
+        self.session.close()
+
+
+def _not_sent(error):
+    ''' Return True if a connection error was raised before the request was
+    sent, I{i.e.} the connection to the node could not be opened. '''
+    reason = error.args[0] if len(error.args) > 0 else None
+    reason = getattr(reason, 'reason', reason)
+    return isinstance(reason, ConnectTimeoutError)
+
+
+class _Call(object):
+    ''' A request in flight. '''
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight(object):
+    ''' Coalesce identical concurrent calls so that callers made while a call
+    with the same key is in flight wait for and share its result. '''
+
+    def __init__(self):
+        self.calls = 0
+        self.coalesced = 0
+        self._in_flight = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, fun):
+        ''' Call fun() or wait for the result of the call already in flight for the key. '''
+        with self._lock:
+            self.calls += 1
+            call = self._in_flight.get(key)
+            if call is not None:
+                self.coalesced += 1
+                is_leader = False
+            else:
+                call = _Call()
+                self._in_flight[key] = call
+                is_leader = True
+
+        if not is_leader:
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fun()
+            return call.result
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._in_flight[key]
+            call.event.set()
+
+    def stats(self):
+        ''' Return the number of calls and how many were coalesced. '''
+        return {"calls": self.calls, "coalesced": self.coalesced}
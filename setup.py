@@ -24,6 +24,7 @@ setup(
     url='http://github.com/D-I-L/django-elastic',
     description='A Django app to run and view Elastic elastic queries.',
     long_description=open(os.path.join(ROOT, 'README.rst')).read(),
+    python_requires='>=3.5',
     install_requires=["requests>=2.7.0", "Django>=1.8.4", "djangorestframework>=3.2.4",
                       "markdown>=2.6.2", "django-filter>=0.11.0", "django-rest-swagger>=0.3.4"],
     classifiers=[
@@ -32,7 +33,7 @@ setup(
         'Intended Audience :: Developers',
         'Operating System :: OS Independent',
         'Programming Language :: Python',
-        'Programming Language :: Python :: 3.4',
+        'Programming Language :: Python :: 3.5',
         'Topic :: Internet :: WWW/HTTP',
         'Topic :: Internet :: WWW/HTTP :: Dynamic Content',
     ],